@@ -1,13 +1,28 @@
 # equation_scribe/autodetect_equations.py
 from __future__ import annotations
+import os
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
+from functools import lru_cache, partial
+from itertools import chain
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Optional
 
-from .pdf_ingest import load_pdf, page_size_points, page_layout_with_ocr
+from .pdf_ingest import PdfDoc, load_pdf, page_size_points, page_layout_with_ocr, _single_threaded_ocr
 from .detect import find_equation_candidates
 from .store import canonical_hash
 
+# Optional fast JSON encoder for the JSONL writer
+try:
+    import orjson
+    _HAS_ORJSON = True
+except Exception:
+    orjson = None
+    _HAS_ORJSON = False
+
+# Repeated text (running headers, equations restated across pages) hashes once per process.
+_hash = lru_cache(maxsize=4096)(canonical_hash)
+
 # NOTE: we intentionally do not save per-record inside the loop anymore.
 # Instead we collect all_records and write the JSONL once at the end,
 # so we can protect existing files and register atomically.
@@ -20,8 +35,74 @@ class AutoDetectConfig:
     Attributes:
         min_score: Minimum candidate score (from detect.find_equation_candidates)
                    to keep as a likely equation.
+        workers: Number of worker processes for page-level detection.
+                 None uses all cores; 1 runs serially in-process.
     """
     min_score: float = 0.6
+    workers: Optional[int] = None
+
+
+def _process_page(doc: PdfDoc, page_index: int, paper_id: str, min_score: float) -> List[Dict[str, Any]]:
+    """
+    Detect equation records on a single page. Pages are independent, so this is
+    the unit of work handed to the process pool (PdfDoc is a plain, picklable
+    dataclass; each worker reopens the PDF by path).
+    """
+    # Unified span extraction: text-layer first, OCR fallback otherwise
+    spans = page_layout_with_ocr(doc, page_index)
+    if not spans:
+        # Nothing to work with on this page
+        return []
+
+    # Page width in PDF points, used for center-ness heuristic in detect.py
+    page_width, _ = page_size_points(doc, page_index)
+
+    # Use your existing "mathy" detector
+    candidates = find_equation_candidates(spans, page_width)
+
+    records: List[Dict[str, Any]] = []
+    for cand in candidates:
+        # Some earlier code already filters by score, but we can enforce it here too.
+        if cand.get("score", 0.0) < min_score:
+            continue
+
+        text = cand.get("text", "")
+        x0, y0, x1, y1 = cand["bbox_pdf"]
+
+        # Generate a stable ID for the equation based on its text.
+        eq_uid = _hash(text)
+
+        record: Dict[str, Any] = {
+            "eq_uid": eq_uid,
+            "paper_id": paper_id,
+            # For now, use the raw extracted text as a placeholder for LaTeX.
+            # Later, we'll run a LaTeX conversion / SymPy validation pass.
+            "latex": text,
+            "notes": "",
+            "boxes": [
+                {
+                    "page": page_index,
+                    "bbox_pdf": [float(x0), float(y0), float(x1), float(y1)],
+                }
+            ],
+        }
+        records.append(record)
+    return records
+
+
+def _merge_duplicates(records: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Collapse records that share an eq_uid (same text on several pages) into the
+    first one, appending the later boxes to its `boxes` list.
+    """
+    by_uid: Dict[str, Dict[str, Any]] = {}
+    for rec in records:
+        first = by_uid.get(rec["eq_uid"])
+        if first is None:
+            by_uid[rec["eq_uid"]] = rec
+        else:
+            first["boxes"].extend(rec["boxes"])
+    return list(by_uid.values())
 
 
 def autodetect_equations(
@@ -42,58 +123,27 @@ def autodetect_equations(
 
     Returns:
         A list of equation records (as plain dicts) that were detected.
+        Candidates with identical text are merged into one record with
+        several boxes.
     """
     cfg = cfg or AutoDetectConfig()
     pdf_path = Path(pdf_path)
     data_root = Path(data_root)
 
-    # Load the PDF (this verifies that it exists and has pages)
-    doc = load_pdf(pdf_path)
-    all_records: List[Dict[str, Any]] = []
+    # Load the PDF (this verifies that it exists and has pages); the serial
+    # path reuses its open document handles, closed again on the way out
+    with load_pdf(pdf_path) as doc:
+        worker = partial(_process_page, doc, paper_id=paper_id, min_score=cfg.min_score)
+        pages = range(doc.num_pages)
 
-    for page_index in range(doc.num_pages):
-        # Unified span extraction: text-layer first, OCR fallback otherwise
-        spans = page_layout_with_ocr(doc, page_index)
-        if not spans:
-            # Nothing to work with on this page
-            continue
-
-        # Page width in PDF points, used for center-ness heuristic in detect.py
-        page_width, _ = page_size_points(doc, page_index)
-
-        # Use your existing "mathy" detector
-        candidates = find_equation_candidates(spans, page_width)
-
-        for cand in candidates:
-            # Some earlier code already filters by score, but we can enforce it here too.
-            if cand.get("score", 0.0) < cfg.min_score:
-                continue
-
-            text = cand.get("text", "")
-            x0, y0, x1, y1 = cand["bbox_pdf"]
-
-            # Generate a stable ID for the equation based on its text.
-            eq_uid = canonical_hash(text)
-
-            record: Dict[str, Any] = {
-                "eq_uid": eq_uid,
-                "paper_id": paper_id,
-                # For now, use the raw extracted text as a placeholder for LaTeX.
-                # Later, we'll run a LaTeX conversion / SymPy validation pass.
-                "latex": text,
-                "notes": "",
-                "boxes": [
-                    {
-                        "page": page_index,
-                        "bbox_pdf": [float(x0), float(y0), float(x1), float(y1)],
-                    }
-                ],
-            }
-
-            # Collect record; write will be handled after detection completes.
-            all_records.append(record)
-
-    return all_records
+        # Collect records; write will be handled after detection completes.
+        # ex.map keeps page order, so output is identical to the serial path.
+        workers = min(cfg.workers or os.cpu_count() or 1, doc.num_pages)
+        if workers <= 1:
+            return _merge_duplicates(chain.from_iterable(map(worker, pages)))
+        # workers may OCR scanned pages: one single-threaded tesseract each
+        with ProcessPoolExecutor(max_workers=workers, initializer=_single_threaded_ocr) as ex:
+            return _merge_duplicates(chain.from_iterable(ex.map(worker, pages)))
 
 
 if __name__ == "__main__":
@@ -128,6 +178,12 @@ if __name__ == "__main__":
         default=0.6,
         help="Minimum candidate score to keep (higher = stricter)",
     )
+    ap.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Worker processes for page-level detection (default: all cores; 1 = serial)",
+    )
     ap.add_argument(
         "--force",
         action="store_true",
@@ -135,7 +191,7 @@ if __name__ == "__main__":
     )
 
     args = ap.parse_args()
-    cfg = AutoDetectConfig(min_score=args.min_score)
+    cfg = AutoDetectConfig(min_score=args.min_score, workers=args.workers)
 
     # Run detection (collect records)
     print(f"Running autodetect on {args.pdf} ...")
@@ -159,10 +215,13 @@ if __name__ == "__main__":
             shutil.move(str(out_path), str(bak))
             print(f"Backed up existing {out_path} to {bak}")
 
-        # Write new JSONL
-        with out_path.open("w", encoding="utf-8") as f:
-            for rec in records:
-                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        # Write new JSONL: encode everything first, then one buffered write
+        if _HAS_ORJSON:
+            lines = [orjson.dumps(rec) for rec in records]
+        else:
+            lines = [json.dumps(rec, ensure_ascii=False).encode("utf-8") for rec in records]
+        with out_path.open("wb", buffering=1 << 20) as f:
+            f.write(b"".join(line + b"\n" for line in lines))
 
         print(f"Wrote {len(records)} records to {out_path}")
 
@@ -3,19 +3,28 @@ from __future__ import annotations
 import re
 from typing import List, Dict, Any
 
+import numpy as np
+
 MATH_GLYPHS = set("∑∫∂∇±≈≠≤≥∞√→←×•°≃≅≡⊂⊃⊆⊇∈∉∪∩∧∨¬⇒⇔⊗⊕…")
 GREEK = set("αβγδεζηθικλμνξοπρστυφχψωΑΒΓΔΕΖΗΘΙΚΛΜΝΞΟΠΡΣΤΥΦΧΨΩ")
 LATEX_HINTS = ("\\frac", "\\cdot", "\\nabla", "\\sum", "\\int", "\\partial", "\\sqrt", "\\leq", "\\geq")
 
 OP_CHARS = set("=+-/*^_|()[]{}<>")
 
+# one pass over s for all hints; each hint starts with its only backslash, so
+# matches never overlap and the set of matches equals the set of hints present
+_HINT_RE = re.compile("|".join(re.escape(h) for h in LATEX_HINTS))
+
+# str.translate table that deletes every "mathy" char; the length drop is the count
+_DROP_MATHY = {ord(ch): None for ch in MATH_GLYPHS | GREEK | OP_CHARS}
+
 def _mathy_score(s: str) -> float:
     s = s or ""
     n = len(s)
     if n == 0: return 0.0
-    m = sum(ch in MATH_GLYPHS or ch in GREEK or ch in OP_CHARS for ch in s)
-    m += sum(h in s for h in LATEX_HINTS) * 3
-    alpha = sum(ch.isalpha() for ch in s)
+    m = n - len(s.translate(_DROP_MATHY))
+    m += len(set(_HINT_RE.findall(s))) * 3
+    alpha = sum(map(str.isalpha, s))
     return (m + 1) / (alpha + 5)
 
 def find_equation_candidates(spans: List[Dict[str, Any]], page_width: float) -> List[Dict[str, Any]]:
@@ -26,33 +35,42 @@ def find_equation_candidates(spans: List[Dict[str, Any]], page_width: float) ->
     """
     if not spans: return []
 
-    # crude line clustering by y (pdfplumber "top" coordinate)
-    by_y = {}
+    # crude line clustering by y (pdfplumber "top" coordinate), done column-wise:
+    # bin the tops, stable-argsort by bin, then reduce each run of equal bins.
     BIN = 3.0
-    for w in spans:
-        y = float(w["bbox_pdf"][1])  # top
-        key = round(y / BIN) * BIN
-        by_y.setdefault(key, []).append(w)
+    boxes = np.asarray([w["bbox_pdf"][:4] for w in spans], dtype=np.float64).reshape(-1, 4)
+    keys = np.round(boxes[:, 1] / BIN).astype(np.int64)
+    order = np.argsort(keys, kind="stable")
+    keys_sorted = keys[order]
+    starts = np.flatnonzero(np.diff(keys_sorted, prepend=keys_sorted[0] - 1))
+    ends = np.append(starts[1:], len(order))
+    sorted_boxes = boxes[order]
+    # union bbox per line
+    line_x0 = np.minimum.reduceat(sorted_boxes[:, 0], starts)
+    line_y0 = np.minimum.reduceat(sorted_boxes[:, 1], starts)
+    line_x1 = np.maximum.reduceat(sorted_boxes[:, 2], starts)
+    line_y1 = np.maximum.reduceat(sorted_boxes[:, 3], starts)
 
     candidates = []
-    for y_key, ws in by_y.items():
-        # union bbox
-        xs0 = [w["bbox_pdf"][0] for w in ws]
-        ys0 = [w["bbox_pdf"][1] for w in ws]
-        xs1 = [w["bbox_pdf"][2] for w in ws]
-        ys1 = [w["bbox_pdf"][3] for w in ws]
-        x0, y0, x1, y1 = min(xs0), min(ys0), max(xs1), max(ys1)
-        text = " ".join(w["text"] for w in sorted(ws, key=lambda q: q["bbox_pdf"][0]))
-        score = _mathy_score(text)
+    # visit lines in order of first appearance so score ties keep the page order
+    for g in np.argsort(order[starts], kind="stable"):
+        x0, y0, x1, y1 = float(line_x0[g]), float(line_y0[g]), float(line_x1[g]), float(line_y1[g])
 
         # center-ness: distance of bbox center to page center (0..1)
         cx = 0.5 * (x0 + x1)
         center_dev = abs(cx - page_width / 2) / (page_width / 2)
         centered_bonus = max(0.0, 0.3 - center_dev)  # bonus if near center
 
+        # The score only depends on which chars/hints occur, not on word order,
+        # so score the unsorted words and only sort the lines we keep.
+        members = order[starts[g]:ends[g]]
+        score = _mathy_score(" ".join(spans[i]["text"] for i in members))
         total = score + centered_bonus
-        if total >= 0.1:  # tune this threshold
-            candidates.append({"text": text, "bbox_pdf": (x0, y0, x1, y1), "score": round(total, 3)})
+        if total < 0.1:  # tune this threshold
+            continue
+        members = members[np.argsort(boxes[members, 0], kind="stable")]
+        text = " ".join(spans[i]["text"] for i in members)
+        candidates.append({"text": text, "bbox_pdf": (x0, y0, x1, y1), "score": round(total, 3)})
 
     # sort strongest first
     candidates.sort(key=lambda c: c["score"], reverse=True)
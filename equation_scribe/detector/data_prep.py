@@ -5,6 +5,44 @@ from PIL import Image
 import argparse
 from collections import defaultdict
 import time
+import numpy as np
+
+# Optional fast JSON codec
+try:
+    import orjson
+    HAVE_ORJSON = True
+except Exception:
+    HAVE_ORJSON = False
+
+_json_loads = orjson.loads if HAVE_ORJSON else json.loads
+
+def _write_json(path: Path, obj):
+    """Write obj as indent=2 JSON in one binary write (orjson when available)."""
+    if HAVE_ORJSON:
+        payload = orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    else:
+        payload = json.dumps(obj, indent=2).encode("utf-8")
+    with Path(path).open("wb") as fh:
+        fh.write(payload)
+
+def _iter_jsonl(path: Path, chunk_size: int = 1 << 20):
+    """
+    Yield records from a JSONL file read in binary chunks and split on b"\n",
+    avoiding per-line text decoding. Blank lines are skipped.
+    """
+    tail = b""
+    with Path(path).open("rb") as fh:
+        while True:
+            chunk = fh.read(chunk_size)
+            if not chunk:
+                break
+            lines = (tail + chunk).split(b"\n")
+            tail = lines.pop()
+            for line in lines:
+                if line.strip():
+                    yield _json_loads(line)
+    if tail.strip():
+        yield _json_loads(tail)
 
 def bbox_to_coco(x0, y0, x1, y1):
     w = max(0.0, x1 - x0)
@@ -42,7 +80,7 @@ def convert_from_profiles(
 
     # Attempt to import pdf helpers if available
     try:
-        from equation_scribe.pdf_ingest import load_pdf, pdf_to_px_transform
+        from equation_scribe.pdf_ingest import load_pdf, pdf_bboxes_to_px
         have_pdf_helpers = True
     except Exception:
         have_pdf_helpers = False
@@ -68,73 +106,77 @@ def convert_from_profiles(
     else:
         raise RuntimeError("profiles_jsonl_path not found")
 
+    # The PDF is the same for every record, so load it once
+    doc = None
+    if pdf_path and have_pdf_helpers:
+        try:
+            doc = load_pdf(Path(pdf_path))
+        except Exception:
+            doc = None
+
+    # First pass: collect boxes in file order so the PDF->pixel mapping runs once
+    # per page over an (N,4) array instead of once per corner.
+    entries = []   # (paper_id, page, cls)
+    bboxes = []    # [x0,y0,x1,y1] in PDF pts (or pixels when no PDF is available)
     for f in files:
-        with f.open("r", encoding="utf-8") as fh:
-            for line in fh:
-                rec = json.loads(line)
-                paper_id = rec.get("paper_id")
-                boxes = rec.get("boxes", [])
-                # If PDF path provided, try to load and map
-                doc = None
-                if pdf_path:
-                    try:
-                        pdf_path = Path(pdf_path)
-                        doc = load_pdf(pdf_path)
-                    except Exception:
-                        doc = None
-                for b in boxes:
-                    page = b.get("page", 0)
-                    bbox_pdf = b.get("bbox_pdf")  # expected [x0,y0,x1,y1] in PDF pts
-                    cls = b.get("cls", "display")
-                    # Map PDF bbox to pixels
-                    if doc and have_pdf_helpers and bbox_pdf:
-                        pdf2px, px2pdf = pdf_to_px_transform(doc, page)
-                        x0p, y0p = pdf2px(bbox_pdf[0], bbox_pdf[1])
-                        x1p, y1p = pdf2px(bbox_pdf[2], bbox_pdf[3])
-                    else:
-                        # Fallback: assume bbox_pdf are pixel coords
-                        x0p, y0p, x1p, y1p = bbox_pdf
-
-                    # Determine image filename (try page_images_dir)
-                    if page_images_dir:
-                        img_path = Path(page_images_dir) / f"page_{page:04d}.png"
-                    else:
-                        # fallback: name by paper and page
-                        img_path = Path(f"{paper_id}_page_{page:04d}.png")
-
-                    # create image record if not exists
-                    if str(img_path) not in image_id_map:
-                        if img_path.exists():
-                            with Image.open(img_path) as im:
-                                w,h = im.size
-                        else:
-                            # fallback sizes if image not available
-                            w,h = int(x1p)+10, int(y1p)+10
-                        add_image_record(str(img_path), w, h)
-
-                    img_id = image_id_map[str(img_path)]
-                    coco_bbox = bbox_to_coco(float(x0p), float(y0p), float(x1p), float(y1p))
-                    # category id mapping - use class name if present
-                    if isinstance(cls, str):
-                        cat_id = cat_name_to_id.get(cls, 1)
-                    else:
-                        cat_id = int(cls)+1
-
-                    ann = {
-                        "id": next_ann_id,
-                        "image_id": img_id,
-                        "category_id": cat_id,
-                        "bbox": coco_bbox,
-                        "area": coco_bbox[2]*coco_bbox[3],
-                        "iscrowd": 0,
-                        "segmentation": []
-                    }
-                    annotations.append(ann)
-                    next_ann_id += 1
+        for rec in _iter_jsonl(f):
+            paper_id = rec.get("paper_id")
+            for b in rec.get("boxes", []):
+                bbox_pdf = b.get("bbox_pdf")  # expected [x0,y0,x1,y1] in PDF pts
+                if not bbox_pdf:
+                    continue
+                entries.append((paper_id, b.get("page", 0), b.get("cls", "display")))
+                bboxes.append(bbox_pdf)
+
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+    if doc is not None and entries:
+        # Map PDF bboxes to pixels, one batch per page
+        pages = np.fromiter((e[1] for e in entries), dtype=np.int64, count=len(entries))
+        for page in np.unique(pages):
+            sel = pages == page
+            bboxes[sel] = pdf_bboxes_to_px(doc, int(page), bboxes[sel])
+    # else fallback: assume bbox_pdf are pixel coords
+
+    for (paper_id, page, cls), (x0p, y0p, x1p, y1p) in zip(entries, bboxes.tolist()):
+        # Determine image filename (try page_images_dir)
+        if page_images_dir:
+            img_path = Path(page_images_dir) / f"page_{page:04d}.png"
+        else:
+            # fallback: name by paper and page
+            img_path = Path(f"{paper_id}_page_{page:04d}.png")
+
+        # create image record if not exists
+        if str(img_path) not in image_id_map:
+            if img_path.exists():
+                with Image.open(img_path) as im:
+                    w,h = im.size
+            else:
+                # fallback sizes if image not available
+                w,h = int(x1p)+10, int(y1p)+10
+            add_image_record(str(img_path), w, h)
+
+        img_id = image_id_map[str(img_path)]
+        coco_bbox = bbox_to_coco(x0p, y0p, x1p, y1p)
+        # category id mapping - use class name if present
+        if isinstance(cls, str):
+            cat_id = cat_name_to_id.get(cls, 1)
+        else:
+            cat_id = int(cls)+1
+
+        ann = {
+            "id": next_ann_id,
+            "image_id": img_id,
+            "category_id": cat_id,
+            "bbox": coco_bbox,
+            "area": coco_bbox[2]*coco_bbox[3],
+            "iscrowd": 0,
+            "segmentation": []
+        }
+        annotations.append(ann)
+        next_ann_id += 1
 
     coco = build_coco(images_info, annotations, categories)
     out_path = Path(out_annotations_path)
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    with out_path.open("w", encoding="utf-8") as fh:
-        json.dump(coco, fh, indent=2)
+    _write_json(out_path, coco)
     print("Wrote COCO annotations to", out_path)
@@ -10,7 +10,7 @@ Features:
   equations.jsonl file.
 - Optionally renders PDF pages to images (pdf2image) if page_images_dir is not present.
 - Converts bbox_pdf (PDF points) to pixel coordinates using:
-    - equation_scribe.pdf_ingest.pdf_to_px_transform(doc, page) if available, or
+    - equation_scribe.pdf_ingest.pdf_bboxes_to_px(doc, page, boxes) if available, or
     - a fallback scale assuming page width 612 pts with page height derived from image aspect ratio.
 - Writes a COCO JSON annotation file and enumerates the images.
 
@@ -29,6 +29,7 @@ and `--render-pdf` will be used to generate page images into page-images-dir/<pa
 """
 import json
 import argparse
+import itertools
 from pathlib import Path
 from PIL import Image
 import time
@@ -36,7 +37,21 @@ import math
 import shutil
 import tempfile
 import sys
-from typing import List, Dict, Tuple, Optional
+import os
+from bisect import bisect_left
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from typing import List, Dict, Iterator, Tuple, Optional
+
+import numpy as np
+
+# Optional fast JSON codec
+try:
+    import orjson
+    HAVE_ORJSON = True
+except Exception:
+    HAVE_ORJSON = False
 
 # Optional dependency for PDF rendering
 try:
@@ -47,7 +62,7 @@ except Exception:
 
 # Try to import your repo's pdf helpers
 try:
-    from equation_scribe.pdf_ingest import load_pdf, pdf_to_px_transform
+    from equation_scribe.pdf_ingest import load_pdf, pdf_bboxes_to_px
     HAVE_PDF_HELPERS = True
 except Exception:
     HAVE_PDF_HELPERS = False
@@ -55,6 +70,36 @@ except Exception:
 # Default page width (PDF pts) if we need a fallback conversion
 DEFAULT_PAGE_WIDTH_PT = 612.0
 
+# file_name prefix for pages with no image at all (placeholder size only, no file on disk)
+SYNTHETIC_IMAGE_DIR = "__synthetic__"
+
+_json_loads = orjson.loads if HAVE_ORJSON else json.loads
+
+def _dumps(obj) -> bytes:
+    """Compact JSON bytes (orjson when available)."""
+    if HAVE_ORJSON:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+def _iter_jsonl(path: Path, chunk_size: int = 1 << 20):
+    """
+    Yield records from a JSONL file read in binary chunks and split on b"\n",
+    avoiding per-line text decoding. Blank lines are skipped.
+    """
+    tail = b""
+    with Path(path).open("rb") as fh:
+        while True:
+            chunk = fh.read(chunk_size)
+            if not chunk:
+                break
+            lines = (tail + chunk).split(b"\n")
+            tail = lines.pop()
+            for line in lines:
+                if line.strip():
+                    yield _json_loads(line)
+    if tail.strip():
+        yield _json_loads(tail)
+
 def bbox_to_coco(x0: float, y0: float, x1: float, y1: float) -> List[float]:
     w = max(0.0, x1 - x0)
     h = max(0.0, y1 - y0)
@@ -83,12 +128,75 @@ def render_pdf_pages(pdf_path: Path, out_dir: Path, dpi: int = 150, fmt: str = "
         page.save(fname)
     return len(pages)
 
-def find_equations_jsonl_files(profiles_root: Path) -> List[Path]:
+def render_pdf_page_set(pdf_path: Path, page_indices, out_dir: Path, dpi: int = 150, fmt: str = "png") -> Dict[int, Path]:
     """
-    Search for equations.jsonl files under profiles_root.
+    Render only the given (0-based) pages of pdf_path into out_dir/page_XXXX.<fmt>.
+    Each run of consecutive pages is rendered with a single convert_from_path call,
+    so poppler parses the PDF once per run instead of once per page.
+    Returns {page_index: image path} for the pages that were rendered.
     """
-    files = list(profiles_root.rglob("equations.jsonl"))
-    return files
+    if not HAVE_PDF2IMAGE:
+        raise RuntimeError("pdf2image is required to render PDFs. Install `pip install pdf2image` and poppler.")
+    out_dir.mkdir(parents=True, exist_ok=True)
+    pages = sorted(set(page_indices))
+    rendered = {}
+    start = 0
+    while start < len(pages):
+        end = start
+        while end + 1 < len(pages) and pages[end + 1] == pages[end] + 1:
+            end += 1
+        first, last = pages[start], pages[end]
+        try:
+            images = convert_from_path(str(pdf_path), dpi=dpi, first_page=first+1, last_page=last+1)
+            for page_idx, im in zip(range(first, last + 1), images):
+                fname = out_dir / f"page_{page_idx:04d}.{fmt}"
+                im.save(fname)
+                rendered[page_idx] = fname
+        except Exception as e:
+            print(f"Warning: failed to render pages {first}-{last}:", e)
+        start = end + 1
+    return rendered
+
+def find_equations_jsonl_files(profiles_root: Path) -> Iterator[Path]:
+    """
+    Search for equations.jsonl files under profiles_root, yielding them as the
+    directory walk finds them.
+    """
+    yield from profiles_root.rglob("equations.jsonl")
+
+def index_pdfs(pdf_root: Path):
+    """
+    Walk pdf_root once and return find(paper_id) -> Path or None, giving the first
+    PDF whose file name starts with paper_id (the same pick as
+    rglob(f"{paper_id}*.pdf")[0]).
+    """
+    pdfs = list(Path(pdf_root).rglob("*.pdf"))
+    by_name = sorted((p.name, i) for i, p in enumerate(pdfs))
+    names = [name for name, _ in by_name]
+
+    def find(paper_id: str) -> Optional[Path]:
+        lo = hi = bisect_left(names, paper_id)
+        while hi < len(names) and names[hi].startswith(paper_id):
+            hi += 1
+        if hi == lo:
+            return None
+        # earliest in walk order among the prefix matches
+        return pdfs[min(i for _, i in by_name[lo:hi])]
+    return find
+
+@lru_cache(maxsize=256)
+def _dir_listing(folder: str, mtime_ns: int) -> frozenset:
+    return frozenset(entry.name for entry in os.scandir(folder))
+
+def list_dir_cached(folder: Path) -> frozenset:
+    """
+    Names of the entries in folder (empty if it doesn't exist). Cached until the
+    folder's mtime changes, so probing many candidate files costs one stat.
+    """
+    try:
+        return _dir_listing(str(folder), Path(folder).stat().st_mtime_ns)
+    except OSError:
+        return frozenset()
 
 def load_page_image_size(img_path: Path) -> Tuple[int,int]:
     with Image.open(img_path) as im:
@@ -115,6 +223,169 @@ def pdf_bbox_to_pixel_bbox_fallback(bbox_pdf, img_w_px, img_h_px, page_width_pt=
     y_min, y_max = sorted([y0_px, y1_px])
     return [x_min, y_min, x_max, y_max]
 
+def pdf_bboxes_to_pixel_bboxes_fallback(bboxes_pdf, img_w_px, img_h_px, page_width_pt=DEFAULT_PAGE_WIDTH_PT) -> np.ndarray:
+    """
+    Batch form of pdf_bbox_to_pixel_bbox_fallback for an (N,4) array of boxes on one page.
+    Returns an (N,4) array of normalized [x_min, y_min, x_max, y_max] pixel boxes.
+    """
+    b = np.asarray(bboxes_pdf, dtype=np.float64).reshape(-1, 4)
+    page_h_pt = page_width_pt * (img_h_px / img_w_px)
+    sx = img_w_px / page_width_pt
+    sy = img_h_px / page_h_pt
+    xs = b[:, 0::2] * sx
+    ys = (page_h_pt - b[:, 1::2]) * sy
+    return np.stack([xs.min(axis=1), ys.min(axis=1), xs.max(axis=1), ys.max(axis=1)], axis=1)
+
+def _category_id(box: Dict, cat_name_to_id: Dict[str, int]) -> int:
+    """Determine the COCO category id of a profile box from its cls/class/type field."""
+    clsname = box.get("cls", None) or box.get("class", None) or box.get("type", None)
+    if isinstance(clsname, str):
+        return cat_name_to_id.get(clsname, 1)
+    # If numeric class present (0/1), map to ids (1-based)
+    try:
+        return int(box.get("cls", 0)) + 1
+    except Exception:
+        return 1
+
+def _profile_to_coco_parts(
+    eq_file: Path,
+    pdf_candidate: Optional[Path],
+    page_images_dir: Optional[Path],
+    render_pdf: bool,
+    dpi: int,
+    cat_name_to_id: Dict[str, int],
+) -> Tuple[List[Tuple[str, int, int]], np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Convert one equations.jsonl (PROFILES_ROOT/<paper_id>/equations.jsonl) into
+    (images, image_index, category_ids, coco_bboxes): the page images as
+    (file_name, width, height), and for each kept annotation in file order the
+    position of its image in `images`, its category id and its [x,y,w,h] bbox
+    as an (N,4) array. Image/annotation ids are assigned by the caller, so papers
+    can be processed independently (kept at module level so it can be pickled
+    for ProcessPoolExecutor).
+    """
+    # eq_file = PROFILES_ROOT/<paper_id>/equations.jsonl
+    paper_dir = eq_file.parent
+    paper_id = paper_dir.name
+    # locate page image folder for this paper
+    images_folder_for_paper = None
+    if page_images_dir:
+        # prefer per-paper folder
+        pdir = Path(page_images_dir) / paper_id
+        if pdir.exists():
+            images_folder_for_paper = pdir
+        else:
+            # global images dir with page files named <paper>_page_0000.png or page_0000.png
+            images_folder_for_paper = Path(page_images_dir)
+    else:
+        # if user requested render_pdf and pdf exists, create an images folder under detector/data/images/<paper_id>
+        if render_pdf and pdf_candidate:
+            out_dir = Path("detector/data/images") / paper_id
+            out_dir.mkdir(parents=True, exist_ok=True)
+            print(f"Rendering PDF {pdf_candidate} to {out_dir} at {dpi} DPI...")
+            try:
+                render_pdf_pages(pdf_candidate, out_dir, dpi=dpi)
+                images_folder_for_paper = out_dir
+            except Exception as e:
+                print("ERROR rendering PDF:", e)
+                images_folder_for_paper = None
+        else:
+            images_folder_for_paper = None
+
+    # if pdf helpers available and a pdf exists, load doc once
+    doc = None
+    if HAVE_PDF_HELPERS and pdf_candidate:
+        try:
+            doc = load_pdf(pdf_candidate)
+        except Exception:
+            doc = None
+
+    # Read equations.jsonl. Boxes are grouped by page so that image lookup and the
+    # PDF->pixel mapping run once per page over an (N,4) array; annotations are
+    # still emitted in file order below.
+    # Each box is reduced to the fields used below as it is parsed.
+    file_boxes = []                    # (page_idx, category_id) in file order
+    bboxes = []                        # bbox_pdf rows, parallel to file_boxes
+    page_rows = defaultdict(list)      # page_idx -> row indices into file_boxes
+    for rec in _iter_jsonl(eq_file):
+        for box in rec.get("boxes", []):
+            bbox_pdf = box.get("bbox_pdf")
+            if not bbox_pdf:
+                continue
+            page_idx = int(box.get("page", 0))
+            page_rows[page_idx].append(len(file_boxes))
+            file_boxes.append((page_idx, _category_id(box, cat_name_to_id)))
+            bboxes.append(bbox_pdf)
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+
+    # Determine image path per page (priority):
+    # 1) images_folder_for_paper / page_{page_idx:04d}.png
+    # 2) images_folder_for_paper / <paper>_page_{page_idx:04d}.png
+    # 3) paper_dir/images/page_{page_idx:04d}.png
+    # Candidates are checked against cached directory listings rather than stat'ed one by one
+    known = {folder: list_dir_cached(folder) for folder in (images_folder_for_paper, paper_dir / "images") if folder}
+    found = {}                         # page_idx -> existing image path or None
+    for page_idx in page_rows:
+        img_path_candidates = []
+        if images_folder_for_paper:
+            img_path_candidates.append(images_folder_for_paper / f"page_{page_idx:04d}.png")
+            img_path_candidates.append(images_folder_for_paper / f"{paper_id}_page_{page_idx:04d}.png")
+        img_path_candidates.append(paper_dir / "images" / f"page_{page_idx:04d}.png")
+        found[page_idx] = next((p for p in img_path_candidates if p.name in known[p.parent]), None)
+
+    # If pages are missing and the PDF is available, render all of them up front
+    # (one pdf2image call per run of consecutive pages)
+    missing = [page_idx for page_idx, img in found.items() if img is None]
+    if missing and doc and HAVE_PDF2IMAGE:
+        tmp_folder = Path("detector/data/images/_tmp") / paper_id
+        found.update(render_pdf_page_set(pdf_candidate, missing, tmp_folder, dpi=dpi))
+
+    px_boxes = np.empty((len(file_boxes), 4), dtype=np.float64)
+    page_images = {}                   # page_idx -> (chosen_img, img_w, img_h)
+    for page_idx, rows in page_rows.items():
+        bboxes_pdf = bboxes[rows]
+        chosen_img = found[page_idx]
+
+        if chosen_img:
+            img_w, img_h = load_page_image_size(chosen_img)
+        else:
+            # If still not found, record a placeholder image large enough to include the
+            # page's first bbox (assume bbox_pdf is in pixel coords as last resort). No
+            # file is written; the SYNTHETIC_IMAGE_DIR prefix marks it as having no pixels.
+            x0p, y0p, x1p, y1p = bboxes_pdf[0]
+            img_w = int(max(1024, math.ceil(x1p + 10)))
+            img_h = int(max(1024, math.ceil(y1p + 10)))
+            chosen_img = f"{SYNTHETIC_IMAGE_DIR}/{paper_id}_page_{page_idx:04d}.png"
+        page_images[page_idx] = (chosen_img, img_w, img_h)
+        # Convert PDF bboxes to pixel bboxes
+        # Prefer using repo pdf helpers if doc was available
+        if doc and HAVE_PDF_HELPERS:
+            try:
+                px_boxes[rows] = pdf_bboxes_to_px(doc, page_idx, bboxes_pdf)
+            except Exception:
+                # fallback to generic conversion
+                px_boxes[rows] = pdf_bboxes_to_pixel_bboxes_fallback(bboxes_pdf, img_w, img_h)
+        else:
+            # fallback conversion
+            px_boxes[rows] = pdf_bboxes_to_pixel_bboxes_fallback(bboxes_pdf, img_w, img_h)
+
+    # Results are kept column-wise (structure of arrays); the caller builds the
+    # annotation dicts only when writing them out.
+    page_list = list(page_images)
+    page_pos = {page_idx: k for k, page_idx in enumerate(page_list)}
+    image_index = np.fromiter((page_pos[p] for p, _ in file_boxes), dtype=np.int32, count=len(file_boxes))
+    cat_ids = np.fromiter((c for _, c in file_boxes), dtype=np.int32, count=len(file_boxes))
+    # Normalize & clip to image bounds, then drop empty boxes - all rows at once
+    sizes = np.array([page_images[p][1:] for p in page_list], dtype=np.float64).reshape(-1, 2)[image_index]
+    np.clip(px_boxes[:, 0::2], 0.0, sizes[:, 0:1] - 1, out=px_boxes[:, 0::2])
+    np.clip(px_boxes[:, 1::2], 0.0, sizes[:, 1:2] - 1, out=px_boxes[:, 1::2])
+    x0, y0, x1, y1 = px_boxes.T
+    valid = (x1 > x0) & (y1 > y0)
+    coco_bboxes = np.stack([x0, y0, x1 - x0, y1 - y0], axis=1)  # [x,y,w,h]
+
+    images = [(str(page_images[p][0]), page_images[p][1], page_images[p][2]) for p in page_list]
+    return images, image_index[valid], cat_ids[valid], coco_bboxes[valid]
+
 def convert_profiles_to_coco(
     profiles_root: Path,
     out_annotations: Path,
@@ -123,11 +394,14 @@ def convert_profiles_to_coco(
     render_pdf: bool = False,
     dpi: int = 150,
     split: float = 1.0,
-    categories=None
+    categories=None,
+    workers: Optional[int] = None
 ):
     """
     Convert all equations.jsonl under profiles_root into a COCO annotations file.
     If split < 1.0, it will write train/val splits: instances_train.json / instances_val.json
+    Papers are converted in parallel with `workers` processes (default: all cores);
+    ids are then assigned in file order, so the output matches a serial run.
     """
     profiles_root = Path(profiles_root)
     out_annotations = Path(out_annotations)
@@ -135,12 +409,14 @@ def convert_profiles_to_coco(
         categories = [{"id":1,"name":"display"}, {"id":2,"name":"inline"}]
     cat_name_to_id = {c["name"]: c["id"] for c in categories}
 
+    # files are consumed lazily, so work starts while the walk is still running
     files = find_equations_jsonl_files(profiles_root)
-    if not files:
+    first = next(files, None)
+    if first is None:
         raise RuntimeError(f"No equations.jsonl found under {profiles_root}")
+    files = itertools.chain([first], files)
 
     images_info = []
-    annotations = []
     image_id_map = {}
     next_image_id = 1
     next_ann_id = 1
@@ -153,181 +429,57 @@ def convert_profiles_to_coco(
         next_image_id += 1
         return img_record["id"]
 
-    # Iterate profiles
-    for eq_file in files:
-        # eq_file = PROFILES_ROOT/<paper_id>/equations.jsonl
-        paper_dir = eq_file.parent
-        paper_id = paper_dir.name
-        # possible pdf path
-        pdf_candidate = None
-        if pdf_root:
-            # try to find pdf with same basename under pdf_root
-            # allow common suffixes
-            candidates = list(Path(pdf_root).rglob(f"{paper_id}*.pdf"))
-            if candidates:
-                pdf_candidate = candidates[0]
-        # locate page image folder for this paper
-        images_folder_for_paper = None
-        if page_images_dir:
-            # prefer per-paper folder
-            pdir = Path(page_images_dir) / paper_id
-            if pdir.exists():
-                images_folder_for_paper = pdir
-            else:
-                # global images dir with page files named <paper>_page_0000.png or page_0000.png
-                images_folder_for_paper = Path(page_images_dir)
-        else:
-            # if user requested render_pdf and pdf exists, create an images folder under detector/data/images/<paper_id>
-            if render_pdf and pdf_candidate:
-                out_dir = Path("detector/data/images") / paper_id
-                out_dir.mkdir(parents=True, exist_ok=True)
-                print(f"Rendering PDF {pdf_candidate} to {out_dir} at {dpi} DPI...")
-                try:
-                    render_pdf_pages(pdf_candidate, out_dir, dpi=dpi)
-                    images_folder_for_paper = out_dir
-                except Exception as e:
-                    print("ERROR rendering PDF:", e)
-                    images_folder_for_paper = None
-            else:
-                images_folder_for_paper = None
-
-        # if pdf helpers available and a pdf exists, load doc once
-        doc = None
-        if HAVE_PDF_HELPERS and pdf_candidate:
-            try:
-                doc = load_pdf(pdf_candidate)
-            except Exception:
-                doc = None
-
-        # Read equations.jsonl
-        with eq_file.open("r", encoding="utf-8") as fh:
-            for line in fh:
-                if not line.strip():
-                    continue
-                rec = json.loads(line)
-                boxes = rec.get("boxes", [])
-                for box in boxes:
-                    page_idx = int(box.get("page", 0))
-                    bbox_pdf = box.get("bbox_pdf")
-                    if not bbox_pdf:
-                        continue
-                    # Determine image path (priority):
-                    # 1) images_folder_for_paper / page_{page_idx:04d}.png
-                    # 2) images_folder_for_paper / <paper>_page_{page_idx:04d}.png
-                    # 3) fallback: paper_id + page
-                    img_path_candidates = []
-                    if images_folder_for_paper:
-                        img_path_candidates.append(images_folder_for_paper / f"page_{page_idx:04d}.png")
-                        img_path_candidates.append(images_folder_for_paper / f"{paper_id}_page_{page_idx:04d}.png")
-                    # also check paper_dir/images/page_0000.png
-                    maybe_local = paper_dir / "images" / f"page_{page_idx:04d}.png"
-                    img_path_candidates.append(maybe_local)
-                    chosen_img = None
-                    for p in img_path_candidates:
-                        if p and p.exists():
-                            chosen_img = p
-                            break
-
-                    # If not found and doc is available, we can render just this page to a temp image
-                    temp_image = None
-                    if not chosen_img and doc:
-                        # render a single page using pdf2image (if available)
-                        if HAVE_PDF2IMAGE:
-                            tmp_folder = Path("detector/data/images/_tmp") / paper_id
-                            tmp_folder.mkdir(parents=True, exist_ok=True)
-                            try:
-                                pages = convert_from_path(str(pdf_candidate), dpi=dpi, first_page=page_idx+1, last_page=page_idx+1)
-                                # pages list should have one image
-                                tmp_file = tmp_folder / f"page_{page_idx:04d}.png"
-                                pages[0].save(tmp_file)
-                                chosen_img = tmp_file
-                                temp_image = tmp_file
-                            except Exception as e:
-                                print("Warning: failed to render page", e)
-                                chosen_img = None
-
-                    # If still not found, create a synthetic image size fallback
-                    if not chosen_img:
-                        # we'll create a dummy image size large enough to include bbox
-                        # assume bbox_pdf is in pixel coords as last resort
-                        x0p, y0p, x1p, y1p = bbox_pdf
-                        width = int(max(1024, math.ceil(x1p + 10)))
-                        height = int(max(1024, math.ceil(y1p + 10)))
-                        # create a small temp image
-                        tmp_folder = Path("detector/data/images/_generated")
-                        tmp_folder.mkdir(parents=True, exist_ok=True)
-                        chosen_img = tmp_folder / f"{paper_id}_page_{page_idx:04d}.png"
-                        if not chosen_img.exists():
-                            from PIL import Image, ImageDraw
-                            im = Image.new("RGB", (width, height), "white")
-                            im.save(chosen_img)
-
-                    # At this point chosen_img exists
-                    img_w, img_h = load_page_image_size(chosen_img)
-                    # Convert PDF bbox to pixel bbox
-                    # Prefer using repo pdf helpers if doc was available
-                    if doc and HAVE_PDF_HELPERS:
-                        try:
-                            pdf2px, px2pdf = pdf_to_px_transform(doc, page_idx)
-                            # pdf2px expects (x_pt, y_pt) and returns pixel coords
-                            x0_px, y0_px = pdf2px(bbox_pdf[0], bbox_pdf[1])
-                            x1_px, y1_px = pdf2px(bbox_pdf[2], bbox_pdf[3])
-                        except Exception:
-                            # fallback to generic conversion
-                            x0_px, y0_px, x1_px, y1_px = pdf_bbox_to_pixel_bbox_fallback(bbox_pdf, img_w, img_h)
-                    else:
-                        # fallback conversion
-                        x0_px, y0_px, x1_px, y1_px = pdf_bbox_to_pixel_bbox_fallback(bbox_pdf, img_w, img_h)
-
-                    # Normalize & clip to image bounds
-                    x0_px = max(0.0, min(x0_px, img_w-1))
-                    y0_px = max(0.0, min(y0_px, img_h-1))
-                    x1_px = max(0.0, min(x1_px, img_w-1))
-                    y1_px = max(0.0, min(y1_px, img_h-1))
-                    # Ensure valid
-                    if x1_px <= x0_px or y1_px <= y0_px:
-                        # skip invalid boxes
-                        continue
-
-                    fname_rel = str(chosen_img)
-                    if fname_rel not in image_id_map:
-                        img_id = add_image_record(fname_rel, img_w, img_h)
-                    else:
-                        img_id = image_id_map[fname_rel]
-
-                    # Determine category id
-                    clsname = box.get("cls", None) or box.get("class", None) or box.get("type", None)
-                    if isinstance(clsname, str):
-                        cat_id = cat_name_to_id.get(clsname, 1)
-                    else:
-                        # If numeric class present (0/1), map to ids (1-based)
-                        try:
-                            cat_id = int(box.get("cls", 0)) + 1
-                        except Exception:
-                            cat_id = 1
-
-                    coco_bbox = bbox_to_coco(x0_px, y0_px, x1_px, y1_px)
-                    ann = {
-                        "id": next_ann_id,
-                        "image_id": img_id,
-                        "category_id": cat_id,
-                        "bbox": coco_bbox,
-                        "area": coco_bbox[2] * coco_bbox[3],
-                        "iscrowd": 0,
-                        "segmentation": []
-                    }
-                    annotations.append(ann)
-                    next_ann_id += 1
-
-                    # cleanup temp image if any
-                    if temp_image and temp_image.exists():
-                        # keep rendered tmp pages if you want; for now leave them
-                        pass
-
-    coco = build_coco(images_info, annotations, categories)
+    def write_annotations(parts, fh):
+        """Number images/annotations in file order and stream each annotation to fh as it is made."""
+        nonlocal next_ann_id
+        for images, image_index, cat_ids, coco_bboxes in parts:
+            img_ids = [None] * len(images)  # paper-local image -> global id, set on first use
+            for k, cat_id, coco_bbox in zip(image_index.tolist(), cat_ids.tolist(), coco_bboxes.tolist()):
+                img_id = img_ids[k]
+                if img_id is None:
+                    fname, img_w, img_h = images[k]
+                    img_id = image_id_map.get(fname)
+                    if img_id is None:
+                        img_id = add_image_record(fname, img_w, img_h)
+                    img_ids[k] = img_id
+                ann = {
+                    "id": next_ann_id,
+                    "image_id": img_id,
+                    "category_id": cat_id,
+                    "bbox": coco_bbox,
+                    "area": coco_bbox[2] * coco_bbox[3],
+                    "iscrowd": 0,
+                    "segmentation": []
+                }
+                fh.write((b",\n" if next_ann_id > 1 else b"\n") + _dumps(ann))
+                next_ann_id += 1
+
+    # possible pdf path per paper (eq_file = PROFILES_ROOT/<paper_id>/equations.jsonl);
+    # file names may carry common suffixes after the paper id
+    find_pdf = index_pdfs(pdf_root) if pdf_root else (lambda paper_id: None)
+    files, files_for_pdf = itertools.tee(files)
+    pdf_paths = (find_pdf(f.parent.name) for f in files_for_pdf)
+
+    worker = partial(_profile_to_coco_parts, page_images_dir=page_images_dir,
+                     render_pdf=render_pdf, dpi=dpi, cat_name_to_id=cat_name_to_id)
+    workers = workers or os.cpu_count() or 1
+
+    # The COCO file is streamed one record per line: annotations are written as each
+    # paper's results arrive, and the (much smaller) image list follows them, so the
+    # full annotation list is never held in memory.
+    head = build_coco([], [], categories)
     out_annotations.parent.mkdir(parents=True, exist_ok=True)
-    with out_annotations.open("w", encoding="utf-8") as fh:
-        json.dump(coco, fh, indent=2)
+    with out_annotations.open("wb", buffering=1 << 20) as fh:
+        fh.write(b'{"info":' + _dumps(head["info"]) + b',"licenses":' + _dumps(head["licenses"])
+                 + b',"annotations":[')
+        if workers == 1:
+            write_annotations(map(worker, files, pdf_paths), fh)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as ex:
+                write_annotations(ex.map(worker, files, pdf_paths, chunksize=8), fh)
+        fh.write(b'\n],"images":[')
+        fh.write(b",".join(b"\n" + _dumps(img) for img in images_info))
+        fh.write(b'\n],"categories":' + _dumps(categories) + b"}\n")
     print("Wrote COCO annotations to", out_annotations)
     return out_annotations
 
@@ -340,6 +492,7 @@ def main():
     p.add_argument("--render-pdf", action="store_true", help="Render PDF pages if page images are missing (requires pdf2image/poppler)")
     p.add_argument("--dpi", type=int, default=150, help="DPI for rendering pages")
     p.add_argument("--split", type=float, default=1.0, help="If <1.0, reserved fraction for training; otherwise single JSON output")
+    p.add_argument("--workers", type=int, default=None, help="Worker processes for converting papers (default: all cores)")
     args = p.parse_args()
 
     profiles_root = Path(args.profiles_root)
@@ -359,7 +512,8 @@ def main():
         render_pdf=args.render_pdf,
         dpi=args.dpi,
         split=args.split,
-        categories=[{"id":1,"name":"display"}, {"id":2,"name":"inline"}]
+        categories=[{"id":1,"name":"display"}, {"id":2,"name":"inline"}],
+        workers=args.workers
     )
 
 if __name__ == "__main__":
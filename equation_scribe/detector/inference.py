@@ -5,40 +5,61 @@ from pathlib import Path
 import json
 from PIL import Image
 
+# loaded models by weights path, so repeated calls don't reload the weights
+_model_cache = {}
+
+def get_model(model_path):
+    """Return the YOLO model for model_path, loading it on first use."""
+    key = str(model_path)
+    model = _model_cache.get(key)
+    if model is None:
+        model = _model_cache[key] = YOLO(key)
+    return model
+
 def detect_image(model_path, image_path, conf_thresh=0.25, iou=0.5):
-    model = YOLO(model_path)
+    model = get_model(model_path)
     results = model.predict(source=str(image_path), conf=conf_thresh, iou=iou, max_det=300)
-    r = results[0]
-    boxes = []
-    if hasattr(r, "boxes"):
-        for box in r.boxes:
-            xyxy = box.xyxy[0].numpy().tolist()  # [x1,y1,x2,y2]
-            conf = float(box.conf[0])
-            clsid = int(box.cls[0])
-            boxes.append({"xyxy": xyxy, "conf": conf, "cls": clsid})
-    return boxes
+    return _result_boxes(results[0])
+
+def detect_images(model_path, image_paths, conf_thresh=0.25, iou=0.5, batch=16):
+    """
+    Run detection over many page images with batched forward passes.
+    Returns one list of boxes (as in detect_image) per input image, in input order.
+    """
+    sources = [str(p) for p in image_paths]
+    if not sources:
+        return []
+    model = get_model(model_path)
+    results = model.predict(source=sources, conf=conf_thresh, iou=iou, max_det=300, batch=batch, stream=True)
+    return [_result_boxes(r) for r in results]
+
+def _result_boxes(r):
+    """
+    Extract detections from one ultralytics result as [{"xyxy", "conf", "cls"}].
+    Boxes, scores and classes are fetched as whole tensors (one device->host copy
+    each) rather than box by box.
+    """
+    if not hasattr(r, "boxes") or r.boxes is None:
+        return []
+    xyxy = r.boxes.xyxy.cpu().numpy().tolist()  # [[x1,y1,x2,y2], ...]
+    confs = r.boxes.conf.cpu().numpy().tolist()
+    clsids = r.boxes.cls.cpu().numpy().astype(int).tolist()
+    return [{"xyxy": b, "conf": c, "cls": k} for b, c, k in zip(xyxy, confs, clsids)]
 
 def px_boxes_to_pdf_coords(pdf_path, page_index, px_boxes):
     """Convert px box coordinates to PDF coordinates using equation_scribe.pdf_ingest functions."""
     try:
-        from equation_scribe.pdf_ingest import load_pdf, pdf_to_px_transform
+        from equation_scribe.pdf_ingest import load_pdf, px_bboxes_to_pdf
     except Exception as e:
         raise RuntimeError("Could not import equation_scribe.pdf_ingest. Run this inside the repo or adjust PYTHONPATH.") from e
 
     doc = load_pdf(Path(pdf_path))
-    pdf2px, px2pdf = pdf_to_px_transform(doc, page_index)
-    converted = []
-    for b in px_boxes:
-        x1, y1, x2, y2 = b["xyxy"]
-        # note: px2pdf expects x,y pairs
-        x0_pdf, y0_pdf = px2pdf(x1, y1)
-        x1_pdf, y1_pdf = px2pdf(x2, y2)
-        converted.append({
-            "bbox_pdf": [x0_pdf, y0_pdf, x1_pdf, y1_pdf],
-            "conf": b["conf"],
-            "cls": b["cls"]
-        })
-    return converted
+    # all boxes of the page are converted in one array op
+    bboxes_pdf = px_bboxes_to_pdf(doc, page_index, [b["xyxy"] for b in px_boxes]).tolist()
+    return [
+        {"bbox_pdf": bbox_pdf, "conf": b["conf"], "cls": b["cls"]}
+        for b, bbox_pdf in zip(px_boxes, bboxes_pdf)
+    ]
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -10,106 +10,255 @@ This script expects that for synthetic data, each image has a companion
 file is missing the annotation will be skipped (recognizer needs gold LaTeX).
 """
 from pathlib import Path
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 import argparse
 import json
+import os
+import numpy as np
 from PIL import Image
 from tqdm import tqdm
 
-def crop_and_save(img_path: Path, bbox, out_dir: Path, prefix: str):
+# Optional fast JSON codec
+try:
+    import orjson
+    HAVE_ORJSON = True
+except Exception:
+    HAVE_ORJSON = False
+
+# Optional libvips backend for cropping large pages
+try:
+    import pyvips
+    HAVE_PYVIPS = True
+except Exception:
+    HAVE_PYVIPS = False
+
+# pages with a side at least this long are cropped with pyvips when available
+VIPS_MIN_SIDE = 2000
+
+def _load_json(path: Path):
+    if HAVE_ORJSON:
+        return orjson.loads(Path(path).read_bytes())
+    return json.loads(Path(path).read_text(encoding="utf-8"))
+
+def _jsonl_bytes(records) -> bytes:
+    """Encode records as one JSONL payload so they are written with a single call."""
+    if HAVE_ORJSON:
+        lines = [orjson.dumps(r) for r in records]
+    else:
+        lines = [json.dumps(r, ensure_ascii=False).encode("utf-8") for r in records]
+    return b"".join(line + b"\n" for line in lines)
+
+def _clip_box(bbox, W: int, H: int):
+    """Round a COCO [x,y,w,h] bbox to pixel corners clipped to the image; None if empty."""
     x, y, w, h = bbox
     x0, y0, x1, y1 = int(round(x)), int(round(y)), int(round(x + w)), int(round(y + h))
+    # clip to image bounds
+    x0 = max(0, min(x0, W-1))
+    y0 = max(0, min(y0, H-1))
+    x1 = max(1, min(x1, W))
+    y1 = max(1, min(y1, H))
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return x0, y0, x1, y1
+
+def crop_image(im: Image.Image, bbox, out_dir: Path, prefix: str):
+    """
+    Crop a COCO bbox out of an already-open page image and save it as PNG.
+    out_dir must already exist (it is created once per run, not per crop).
+    """
+    box = _clip_box(bbox, *im.size)
+    if box is None:
+        return None
+    x0, y0, x1, y1 = box
+    crop = im.crop((x0, y0, x1, y1))
+    fname = f"{prefix}_{x0}_{y0}_{x1}_{y1}.png"
+    out_path = out_dir / fname
+    crop.save(out_path)
+    return out_path
+
+def _crop_image_vips(vim, bbox, out_dir: Path, prefix: str):
+    """pyvips twin of crop_image (same clipping and file naming)."""
+    box = _clip_box(bbox, vim.width, vim.height)
+    if box is None:
+        return None
+    x0, y0, x1, y1 = box
+    out_path = out_dir / f"{prefix}_{x0}_{y0}_{x1}_{y1}.png"
+    vim.crop(x0, y0, x1 - x0, y1 - y0).pngsave(str(out_path))
+    return out_path
+
+def crop_and_save(img_path: Path, bbox, out_dir: Path, prefix: str):
+    out_dir.mkdir(parents=True, exist_ok=True)
     with Image.open(img_path) as im:
-        W, H = im.size
-        # clip to image bounds
-        x0 = max(0, min(x0, W-1))
-        y0 = max(0, min(y0, H-1))
-        x1 = max(1, min(x1, W))
-        y1 = max(1, min(y1, H))
-        if x1 <= x0 or y1 <= y0:
-            return None
-        crop = im.crop((x0, y0, x1, y1))
-        out_dir.mkdir(parents=True, exist_ok=True)
-        fname = f"{prefix}_{x0}_{y0}_{x1}_{y1}.png"
-        out_path = out_dir / fname
-        crop.save(out_path)
-        return out_path
+        return crop_image(im, bbox, out_dir, prefix)
+
+def _meta_arrays(img_meta: dict):
+    """
+    Build a small spatial index over the meta `eqs`: bboxes stacked into an (M,4)
+    array sorted by top edge, with their latex strings and original positions.
+    """
+    eqs = img_meta.get("eqs", [])
+    boxes = np.array([rec.get("bbox", [0, 0, 0, 0]) for rec in eqs], dtype=np.float64).reshape(-1, 4)
+    order = np.argsort(boxes[:, 1], kind="stable")
+    latex = [eqs[i].get("latex") for i in order]
+    return boxes[order], latex, order
+
+def _load_meta(meta_path: Path):
+    """Load a page meta file and index its bboxes. Returns _meta_arrays(...) or None."""
+    if not meta_path.exists():
+        return None
+    try:
+        img_meta = _load_json(meta_path)
+    except Exception:
+        return None
+    if not img_meta:
+        return None
+    return _meta_arrays(img_meta)
+
+def _best_overlaps(boxes: np.ndarray, order: np.ndarray, ann_boxes):
+    """
+    Overlap kernel for all annotations of a page at once. For an (A,4) array of
+    COCO [x,y,w,h] boxes, return (best, frac): the position in `boxes` of the best
+    overlapping meta bbox and its intersection as a fraction of the annotation
+    area (-1.0 for empty annotations). Ties keep the record that comes first in
+    the meta file.
+    """
+    a = np.asarray(ann_boxes, dtype=np.float64).reshape(-1, 4)
+    ax0, ay0 = a[:, 0:1], a[:, 1:2]
+    ax1, ay1 = ax0 + a[:, 2:3], ay0 + a[:, 3:4]
+    area = a[:, 2] * a[:, 3]
+    # only boxes whose top edge is above the lowest annotation bottom can intersect
+    n = int(np.searchsorted(boxes[:, 1], ay1.max(initial=-np.inf), side="left"))
+    if n == 0:
+        return np.zeros(len(a), dtype=np.int64), np.full(len(a), -1.0)
+    cand = boxes[:n]
+    iw = np.minimum(cand[:, 2], ax1) - np.maximum(cand[:, 0], ax0)
+    ih = np.minimum(cand[:, 3], ay1) - np.maximum(cand[:, 1], ay0)
+    inter = np.where((iw > 0) & (ih > 0), iw * ih, 0.0)          # (A,n)
+    # visit candidates in meta-file order so argmax picks the earliest of any ties
+    by_file = np.argsort(order[:n], kind="stable")
+    best = by_file[inter[:, by_file].argmax(axis=1)]
+    frac = np.full(len(a), -1.0)
+    ok = area > 0
+    frac[ok] = inter[ok, best[ok]] / area[ok]
+    return best, frac
+
+def _match_latex(boxes: np.ndarray, latex: list, order: np.ndarray, ann_boxes, min_overlap: float = 0.25):
+    """Match each annotation bbox to the latex of its best overlapping meta bbox (None if below min_overlap)."""
+    if len(latex) == 0:
+        return [None] * len(ann_boxes)
+    best, frac = _best_overlaps(boxes, order, ann_boxes)
+    return [latex[b] if f >= min_overlap else None for b, f in zip(best.tolist(), frac.tolist())]
 
 def find_latex_for_annotation(img_meta: dict, ann_bbox):
     """
     Given a page meta JSON (with eqs), find the latex for the annotation by bbox overlap.
     Returns the latex string or None.
     """
-    ax, ay, aw, ah = ann_bbox
-    ax1, ay1 = ax + aw, ay + ah
-    best = None
-    best_iou = 0.0
-    for rec in img_meta.get("eqs", []):
-        bx0, by0, bx1, by1 = rec.get("bbox", [0,0,0,0])
-        bw, bh = bx1 - bx0, by1 - by0
-        # compute intersection
-        ix0 = max(ax, bx0); iy0 = max(ay, by0)
-        ix1 = min(ax1, bx1); iy1 = min(ay1, by1)
-        if ix1 <= ix0 or iy1 <= iy0:
-            continue
-        inter = (ix1 - ix0) * (iy1 - iy0)
-        ann_area = aw * ah
-        if ann_area <= 0:
-            continue
-        iou_like = inter / ann_area
-        if iou_like > best_iou:
-            best_iou = iou_like
-            best = rec.get("latex")
-    # require a minimum overlap
-    if best_iou >= 0.25:
-        return best
-    return None
-
-def coco_to_pairs(coco_json: Path, out_images: Path, out_jsonl: Path, page_images_root: Path = None, pair_prefix="pair"):
-    coco = json.load(open(coco_json, "r", encoding="utf-8"))
-    images = {img["id"]: img for img in coco.get("images", [])}
-    anns = coco.get("annotations", [])
+    return _match_latex(*_meta_arrays(img_meta), [ann_bbox])[0]
+
+def _process_image(img_path: Path, anns, out_images: Path, pair_prefix: str):
+    """
+    Worker for one page image: load its meta file once, match every annotation
+    to its gold latex, then decode the page once and crop all matched boxes.
+    Returns a list of pair dicts. Kept at module level so it can be pickled for
+    ProcessPoolExecutor.
+    """
+    meta = _load_meta(img_path.with_suffix(".meta.json"))
+    if not meta:
+        return []
+    latexes = _match_latex(*meta, [ann['bbox'] for ann in anns])
+    # annotations without gold latex are skipped
+    matched = [(ann, latex) for ann, latex in zip(anns, latexes) if latex]
+    if not matched:
+        return []
+
     pairs = []
-    count = 0
-    for ann in tqdm(anns, desc="cropping"):
-        img = images.get(ann["image_id"])
-        if img is None:
-            continue
+    for ann, latex, out_path in _crop_backend(img_path, matched, out_images, pair_prefix):
+        if out_path:
+            pairs.append({"image": str(out_path), "latex": latex})
+    return pairs
+
+def _crop_backend(img_path: Path, matched, out_images: Path, pair_prefix: str):
+    """
+    Crop all matched boxes from one page, yielding (ann, latex, out_path).
+    Large pages go through libvips (random access, so the page is decoded once
+    for all crops) when pyvips is installed; everything else uses PIL.
+    """
+    if HAVE_PYVIPS:
+        vim = pyvips.Image.new_from_file(str(img_path), access="random")
+        if max(vim.width, vim.height) >= VIPS_MIN_SIDE:
+            for ann, latex in matched:
+                yield ann, latex, _crop_image_vips(vim, ann['bbox'], out_images, f"{pair_prefix}_{ann['id']}")
+            return
+    with Image.open(img_path) as im:
+        im.load()
+        for ann, latex in matched:
+            yield ann, latex, crop_image(im, ann['bbox'], out_images, f"{pair_prefix}_{ann['id']}")
+
+def _resolve_image_paths(images: dict, image_ids, page_images_root: Path = None):
+    """
+    Resolve the on-disk path of each referenced image exactly once, so the
+    filesystem is hit O(images) times rather than O(annotations).
+    Returns {image_id: Path or None}.
+    """
+    resolved = {}
+    for iid in image_ids:
+        img = images[iid]
         img_path = Path(img["file_name"])
-        # resolve relative path under page_images_root if necessary
-        if page_images_root and not img_path.exists():
-            candidate = Path(page_images_root) / img_path.name
-            if candidate.exists():
-                img_path = candidate
         if not img_path.exists():
-            # try metadata path as fallback
+            img_path = None
+            # resolve relative path under page_images_root if necessary
+            if page_images_root:
+                candidate = Path(page_images_root) / Path(img["file_name"]).name
+                if candidate.exists():
+                    img_path = candidate
+        if img_path is None:
             print(f"Warning: image file not found: {img['file_name']}; skipping")
-            continue
+        resolved[iid] = img_path
+    return resolved
 
-        meta_path = img_path.with_suffix(".meta.json")
-        img_meta = None
-        if meta_path.exists():
-            try:
-                img_meta = json.load(open(meta_path, "r", encoding="utf-8"))
-            except Exception:
-                img_meta = None
+def coco_to_pairs(coco_json: Path, out_images: Path, out_jsonl: Path, page_images_root: Path = None, pair_prefix="pair",
+                  workers: int = None):
+    coco = _load_json(coco_json)
+    images = {img["id"]: img for img in coco.get("images", [])}
+    anns = coco.get("annotations", [])
 
-        latex = None
-        if img_meta:
-            latex = find_latex_for_annotation(img_meta, ann['bbox'])
+    # group annotations by image so each page is resolved and decoded once
+    anns_by_image = defaultdict(list)
+    for ann in anns:
+        if ann["image_id"] in images:
+            anns_by_image[ann["image_id"]].append(ann)
+    resolved = _resolve_image_paths(images, anns_by_image, page_images_root)
+    work_paths, work_anns = [], []
+    for iid, group in anns_by_image.items():
+        if resolved[iid] is not None:
+            work_paths.append(resolved[iid])
+            work_anns.append(group)
 
-        if not latex:
-            # No gold latex found; skip this annotation
-            continue
+    out_images.mkdir(parents=True, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    worker = partial(_process_image, out_images=out_images, pair_prefix=pair_prefix)
+    count = 0
+    out_jsonl.parent.mkdir(parents=True, exist_ok=True)
+    # progress counts annotations and is advanced once per page, not per item
+    pbar = tqdm(total=sum(map(len, work_anns)), desc="cropping", unit="ann", mininterval=0.5)
 
-        out_path = crop_and_save(img_path, ann['bbox'], out_images, f"{pair_prefix}_{ann['id']}")
-        if out_path:
-            pairs.append({"image": str(out_path), "latex": latex})
-            count += 1
+    def write_pairs(results, fh):
+        # pairs are appended page by page as results arrive rather than collected first
+        nonlocal count
+        for recs, group in zip(results, work_anns):
+            fh.write(_jsonl_bytes(recs))
+            count += len(recs)
+            pbar.update(len(group))
 
-    out_jsonl.parent.mkdir(parents=True, exist_ok=True)
-    with open(out_jsonl, "w", encoding="utf-8") as fh:
-        for p in pairs:
-            fh.write(json.dumps(p, ensure_ascii=False) + "\n")
+    with pbar, open(out_jsonl, "wb", buffering=1 << 20) as fh:
+        if workers == 1:
+            write_pairs(map(worker, work_paths, work_anns), fh)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as ex:
+                write_pairs(ex.map(worker, work_paths, work_anns, chunksize=4), fh)
     print(f"Wrote {count} pairs to {out_jsonl}")
     return out_jsonl
 
@@ -119,9 +268,11 @@ def main():
     p.add_argument('--out-images', required=True)
     p.add_argument('--out-jsonl', required=True)
     p.add_argument('--page-images-root', default=None, help='Optional root to resolve relative image paths')
+    p.add_argument('--workers', type=int, default=None, help='Worker processes for cropping (default: all cores)')
     args = p.parse_args()
     coco_to_pairs(Path(args.coco), Path(args.out_images), Path(args.out_jsonl),
-                  page_images_root=Path(args.page_images_root) if args.page_images_root else None)
+                  page_images_root=Path(args.page_images_root) if args.page_images_root else None,
+                  workers=args.workers)
 
 if __name__ == '__main__':
     main()
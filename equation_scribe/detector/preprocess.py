@@ -11,26 +11,47 @@ import cv2
 import numpy as np
 from pathlib import Path
 from typing import Tuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 import argparse
+import os
 from tqdm import tqdm
 from PIL import Image
 
 def load_image_cv(path: Path):
-    im = Image.open(path).convert("RGB")
-    arr = np.array(im)
-    return arr
+    # decode with OpenCV straight into one array (no PIL buffer + copy); imdecode on
+    # the raw bytes also copes with non-ASCII paths. Like PIL, ignore EXIF rotation.
+    arr = cv2.imdecode(np.fromfile(str(path), dtype=np.uint8), cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+    if arr is None:
+        # formats OpenCV can't decode
+        return np.array(Image.open(path).convert("RGB"))
+    return cv2.cvtColor(arr, cv2.COLOR_BGR2RGB, dst=arr)
 
 def save_image_cv(arr: np.ndarray, out_path: Path):
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    Image.fromarray(arr).save(out_path)
+    if arr.ndim == 3:
+        arr = cv2.cvtColor(arr, cv2.COLOR_RGB2BGR)
+    ok, buf = cv2.imencode(out_path.suffix or ".png", arr)
+    if not ok:
+        raise RuntimeError(f"could not encode {out_path}")
+    buf.tofile(str(out_path))
 
-def deskew_image(gray: np.ndarray) -> np.ndarray:
-    # Use moments approach on edges; fallback to minAreaRect on text contours
-    blur = cv2.GaussianBlur(gray, (3,3), 0)
+# the skew angle is estimated on a copy downsampled to at most this many pixels per side
+DESKEW_MAX_SIDE = 1024
+
+def deskew_image(gray: np.ndarray, max_side: int = DESKEW_MAX_SIDE) -> np.ndarray:
+    # Use moments approach on edges; fallback to minAreaRect on text contours.
+    # The angle is scale-invariant, so edges are found on a downsampled copy and
+    # only the final rotation touches full-resolution pixels.
+    scale = max_side / max(gray.shape[:2])
+    small = gray if scale >= 1.0 else cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    blur = cv2.GaussianBlur(small, (3,3), 0)
     edges = cv2.Canny(blur, 50, 150)
-    coords = np.column_stack(np.where(edges > 0))
-    if coords.shape[0] < 10:
+    pts = cv2.findNonZero(edges)
+    if pts is None or len(pts) < 10:
         return gray
+    # findNonZero yields (x, y); keep the (row, col) order the angle fix-up below expects
+    coords = np.ascontiguousarray(pts.reshape(-1, 2)[:, ::-1])
     rect = cv2.minAreaRect(coords)
     angle = rect[-1]
     if angle < -45:
@@ -42,11 +63,63 @@ def deskew_image(gray: np.ndarray) -> np.ndarray:
     rotated = cv2.warpAffine(gray, M, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
     return rotated
 
+DENOISE_MODES = ("nlm", "bilateral", "nlm_gpu")
+
+def _have_cuda() -> bool:
+    try:
+        return cv2.cuda.getCudaEnabledDeviceCount() > 0
+    except Exception:
+        return False
+
+def denoise_image(gray: np.ndarray, mode: str = "nlm") -> np.ndarray:
+    """
+    Denoise a grayscale page.
+    - "nlm": fast NL means on the CPU (best quality, by far the slowest step)
+    - "bilateral": edge-preserving bilateral filter, much cheaper for scanned text
+    - "nlm_gpu": NL means on a CUDA device; falls back to "nlm" without CUDA support
+    """
+    if mode == "bilateral":
+        return cv2.bilateralFilter(gray, d=5, sigmaColor=30, sigmaSpace=30)
+    if mode == "nlm_gpu" and _have_cuda():
+        gpu = cv2.cuda_GpuMat()
+        gpu.upload(gray)
+        return cv2.cuda.fastNlMeansDenoising(gpu, h=10, search_window=21, block_size=7).download()
+    if mode not in DENOISE_MODES:
+        raise ValueError(f"unknown denoise mode: {mode}")
+    return cv2.fastNlMeansDenoising(gray, None, h=10, templateWindowSize=7, searchWindowSize=21)
+
+THRESHOLD_MODES = ("gaussian", "mean")
+
+# one CLAHE object per process, reused for every page
+_CLAHE = None
+
+def _get_clahe():
+    global _CLAHE
+    if _CLAHE is None:
+        _CLAHE = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
+    return _CLAHE
+
+# CUDA counterparts, also created once per process: the CLAHE object and one
+# device buffer that every page is uploaded into
+_CUDA_CLAHE = None
+_GPU_MAT = None
+
+def _clahe_cuda(gray: np.ndarray) -> np.ndarray:
+    global _CUDA_CLAHE, _GPU_MAT
+    if _CUDA_CLAHE is None:
+        _CUDA_CLAHE = cv2.cuda.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
+        _GPU_MAT = cv2.cuda_GpuMat()
+    _GPU_MAT.upload(gray)
+    return _CUDA_CLAHE.apply(_GPU_MAT, cv2.cuda_Stream.Null()).download()
+
 def preprocess_image(img_bgr: np.ndarray,
                      denoise: bool = True,
                      deskew: bool = True,
                      clahe: bool = True,
-                     binarize: bool = True) -> np.ndarray:
+                     binarize: bool = True,
+                     denoise_mode: str = "nlm",
+                     threshold_mode: str = "gaussian",
+                     gpu_clahe: bool = False) -> np.ndarray:
     # ensure grayscale
     if img_bgr.ndim == 3:
         gray = cv2.cvtColor(img_bgr, cv2.COLOR_RGB2GRAY)
@@ -54,8 +127,8 @@ def preprocess_image(img_bgr: np.ndarray,
         gray = img_bgr.copy()
 
     if denoise:
-        # fast NL means denoising (good for scanned pages)
-        gray = cv2.fastNlMeansDenoising(gray, None, h=10, templateWindowSize=7, searchWindowSize=21)
+        # fast NL means denoising by default (good for scanned pages)
+        gray = denoise_image(gray, denoise_mode)
 
     if deskew:
         try:
@@ -63,30 +136,51 @@ def preprocess_image(img_bgr: np.ndarray,
         except Exception:
             pass
 
+    # gray is our own buffer by now: CLAHE and the threshold both write into it in
+    # place instead of allocating a fresh page-sized image per stage
     if clahe:
-        clahe_obj = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-        gray = clahe_obj.apply(gray)
+        if gpu_clahe and _have_cuda():
+            gray = _clahe_cuda(gray)
+        else:
+            _get_clahe().apply(gray, gray)
 
     if binarize:
-        # adaptive threshold
+        # adaptive threshold; "mean" compares each pixel against a box mean
+        # (summed-area style, O(1) per pixel) instead of a 25x25 Gaussian window
+        if threshold_mode not in THRESHOLD_MODES:
+            raise ValueError(f"unknown threshold mode: {threshold_mode}")
+        method = cv2.ADAPTIVE_THRESH_MEAN_C if threshold_mode == "mean" else cv2.ADAPTIVE_THRESH_GAUSSIAN_C
         try:
-            gray = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                                         cv2.THRESH_BINARY, 25, 10)
+            cv2.adaptiveThreshold(gray, 255, method, cv2.THRESH_BINARY, 25, 10, dst=gray)
         except Exception:
             # fallback global threshold
             _, gray = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
     return gray
 
-def process_folder(in_dir: Path, out_dir: Path, **kwargs):
+def _process_one(path: Path, out_dir: Path, **kwargs):
+    """Preprocess one image file into out_dir (module level so it can be pickled for ProcessPoolExecutor)."""
+    arr = load_image_cv(path)
+    out = preprocess_image(arr, **kwargs)
+    save_image_cv(out, out_dir / path.name)
+
+def _init_worker():
+    # one process per core already; keep OpenCV from spawning its own threads on top
+    cv2.setNumThreads(1)
+
+def process_folder(in_dir: Path, out_dir: Path, workers: int = None, **kwargs):
     in_dir = Path(in_dir)
     out_dir = Path(out_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
     files = sorted([p for p in in_dir.glob("**/*") if p.suffix.lower() in [".png", ".jpg", ".jpeg", ".tif", ".tiff"]])
-    for p in tqdm(files, desc="Preprocessing images"):
-        arr = load_image_cv(p)
-        out = preprocess_image(arr, **kwargs)
-        out_path = out_dir / p.name
-        save_image_cv(out, out_path)
+    worker = partial(_process_one, out_dir=out_dir, **kwargs)
+    workers = min(workers or os.cpu_count() or 1, max(len(files), 1))
+    if workers == 1:
+        for p in tqdm(files, desc="Preprocessing images"):
+            worker(p)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as ex:
+            for _ in tqdm(ex.map(worker, files), total=len(files), desc="Preprocessing images"):
+                pass
     print("Preprocessed", len(files), "images ->", out_dir)
 
 def main():
@@ -95,10 +189,20 @@ def main():
     parser.add_argument("--output", required=True, help="Folder to write preprocessed images")
     parser.add_argument("--deskew", action="store_true")
     parser.add_argument("--denoise", action="store_true")
+    parser.add_argument("--denoise-mode", choices=DENOISE_MODES, default="nlm",
+                        help="Denoiser used with --denoise (bilateral is much faster than NL means)")
     parser.add_argument("--clahe", action="store_true")
+    parser.add_argument("--gpu-clahe", action="store_true",
+                        help="Run CLAHE on a CUDA device when OpenCV has CUDA support (pair with a low --workers)")
     parser.add_argument("--binarize", action="store_true")
+    parser.add_argument("--threshold-mode", choices=THRESHOLD_MODES, default="gaussian",
+                        help="Local threshold used with --binarize (mean is a cheaper box-window mean)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
     args = parser.parse_args()
-    process_folder(Path(args.input), Path(args.output), denoise=args.denoise, deskew=args.deskew, clahe=args.clahe, binarize=args.binarize)
+    process_folder(Path(args.input), Path(args.output), workers=args.workers,
+                   denoise=args.denoise, denoise_mode=args.denoise_mode, deskew=args.deskew,
+                   clahe=args.clahe, gpu_clahe=args.gpu_clahe,
+                   binarize=args.binarize, threshold_mode=args.threshold_mode)
 
 if __name__ == "__main__":
     main()
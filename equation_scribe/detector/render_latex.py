@@ -19,15 +19,20 @@ import os
 import shutil
 import subprocess
 import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
 from pathlib import Path
 import argparse
+import hashlib
 import sys
 import logging
 
 # matplotlib path
 import matplotlib
 matplotlib.use("Agg")
-import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+import numpy as np
 from PIL import Image
 
 # pdf2image optional
@@ -43,40 +48,92 @@ ch = logging.StreamHandler()
 logger.addHandler(ch)
 
 
-def _matplotlib_render(expr: str, out_path: str, dpi: int = 200, fontsize: int = 28):
-    """Render the expression with matplotlib mathtext (fast, but limited)."""
-    fig = plt.figure(figsize=(3, 1))
+# One Figure + Agg canvas per process, cleared and reused for every equation
+# (worker processes each get their own copy of this module state).
+_FIG = None
+
+
+def _get_figure(dpi: int) -> Figure:
+    global _FIG
+    if _FIG is None:
+        _FIG = Figure()
+        FigureCanvasAgg(_FIG)
+    _FIG.clear()
+    _FIG.set_dpi(dpi)
+    return _FIG
+
+
+def _matplotlib_render(expr: str, out_path: str = None, dpi: int = 200, fontsize: int = 28):
+    """Render the expression with matplotlib mathtext (fast, but limited).
+
+    Returns the RGB image itself when out_path is None, otherwise saves it and returns out_path.
+    """
+    fig = _get_figure(dpi)
+    canvas = fig.canvas
     # place in figure center
-    plt.text(0.5, 0.5, f"${expr}$", fontsize=fontsize, ha="center", va="center")
-    plt.axis("off")
-    # save to a temporary file and then re-open to ensure RGB
-    tmp = out_path + ".tmp.png"
-    fig.savefig(tmp, dpi=dpi, bbox_inches="tight", pad_inches=0.05)
-    plt.close(fig)
-    # convert to RGB to normalize format
-    Image.open(tmp).convert("RGB").save(out_path)
-    try:
-        os.remove(tmp)
-    except Exception:
-        pass
+    text = fig.text(0.5, 0.5, f"${expr}$", fontsize=fontsize, ha="center", va="center")
+    # Size the canvas the way savefig(bbox_inches="tight", pad_inches=0.05) used to crop a
+    # 3x1in figure: the union of its (hidden) axes box and the text extent, both centered,
+    # plus padding. Then read the pixels straight from Agg -- no PNG written and re-read.
+    ext = text.get_window_extent(renderer=canvas.get_renderer())
+    rc = matplotlib.rcParams
+    axes_w = (rc["figure.subplot.right"] - rc["figure.subplot.left"]) * 3 * dpi
+    axes_h = (rc["figure.subplot.top"] - rc["figure.subplot.bottom"]) * 1 * dpi
+    pad = 2 * 0.05 * dpi
+    fig.set_size_inches((max(axes_w, ext.width) + pad) / dpi, (max(axes_h, ext.height) + pad) / dpi)
+    canvas.draw()
+    img = Image.fromarray(np.asarray(canvas.buffer_rgba())).convert("RGB")
+    if out_path is None:
+        return img
+    img.save(out_path)
     return out_path
 
 
-def _latex_render(expr: str, out_path: str, dpi: int = 300, packages=None):
-    """
-    Render expression using pdflatex -> pdf -> png.
+# Precompiled preamble formats are kept here across calls and processes (one .fmt per preamble).
+TEX_FORMAT_DIR = Path(tempfile.gettempdir()) / "eq_scribe_tex"
 
-    Uses the standalone documentclass (tight bounding) and ensures the expression
-    is placed inside math mode when appropriate (especially for \begin{...}).
-    """
-    if shutil.which("pdflatex") is None:
+
+@lru_cache(maxsize=1)
+def _pdflatex_path():
+    return shutil.which("pdflatex")
+
+
+def _check_latex_tools():
+    if _pdflatex_path() is None:
         raise RuntimeError("pdflatex not found on PATH. Please install TeX (MiKTeX or TeX Live).")
 
     if not HAVE_PDF2IMAGE:
         raise RuntimeError("pdf2image not installed; needed to convert PDF -> PNG. `pip install pdf2image` and install poppler.")
 
-    packages = packages or ["amsmath", "amssymb", "amsfonts", "bm"]
 
+@lru_cache(maxsize=8)
+def _preamble_format(preamble: str):
+    """
+    Dump the preamble (class + packages) into a pdflatex format once, so later
+    compiles load it in one read instead of re-parsing every .cls/.sty file.
+    Returns the format name, or None if it could not be built.
+    """
+    name = "eqpre_" + hashlib.sha1(preamble.encode("utf-8")).hexdigest()[:12]
+    if (TEX_FORMAT_DIR / f"{name}.fmt").exists():
+        return name
+    try:
+        TEX_FORMAT_DIR.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=TEX_FORMAT_DIR) as td:
+            src = Path(td) / f"{name}.tex"
+            src.write_text(preamble + "\\dump\n", encoding="utf-8")
+            cmd = [_pdflatex_path(), "-ini", "-interaction=nonstopmode", "-halt-on-error", f"-jobname={name}",
+                   "-output-directory", td, "&pdflatex", str(src)]
+            subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            # rename into place so concurrent workers never load a half-written format
+            os.replace(Path(td) / f"{name}.fmt", TEX_FORMAT_DIR / f"{name}.fmt")
+    except Exception as e:
+        logger.warning("Could not precompile LaTeX preamble (%s); using full documents. Error: %s", type(e).__name__, e)
+        return None
+    return name
+
+
+def _math_block(expr: str) -> str:
+    """Place expr inside math mode when appropriate (especially for \\begin{...})."""
     s = expr.strip()
 
     # Decide whether this needs display-math wrapping.
@@ -93,30 +150,28 @@ def _latex_render(expr: str, out_path: str, dpi: int = 300, packages=None):
 
     # Construct the math block to place inside the standalone document.
     if needs_display_math and not already_math:
-        math_block = "\\[\n" + expr + "\n\\]"
+        return "\\[\n" + expr + "\n\\]"
     elif not needs_display_math and not already_math:
         # Use inline math for short expressions
-        math_block = "\\(" + expr + "\\)"
+        return "\\(" + expr + "\\)"
     else:
         # Already has math delimiters or is intentionally a LaTeX fragment
-        math_block = expr
+        return expr
 
-    tex = r"""\documentclass[varwidth=true, border=2pt]{standalone}
-\usepackage{%s}
-\begin{document}
-%s
-\end{document}
-""" % (",".join(packages), math_block)
 
+def _compile_pdflatex(preamble: str, body: str, dpi: int, single_file: bool, fmt) -> list:
     with tempfile.TemporaryDirectory() as td:
         td = Path(td)
         tex_file = td / "eq.tex"
-        tex_file.write_text(tex, encoding="utf-8")
+        # with a precompiled format the preamble is already loaded
+        tex_file.write_text(body if fmt else preamble + body, encoding="utf-8")
 
-        # run pdflatex
-        cmd = ["pdflatex", "-interaction=nonstopmode", "-halt-on-error", "-output-directory", str(td), str(tex_file)]
+        # run pdflatex (from the format dir so "&fmt" resolves)
+        cmd = [_pdflatex_path(), "-interaction=nonstopmode", "-halt-on-error", "-output-directory", str(td)]
+        cmd += [f"&{fmt}", str(tex_file)] if fmt else [str(tex_file)]
         try:
-            subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                           cwd=TEX_FORMAT_DIR if fmt else None)
         except subprocess.CalledProcessError as e:
             # capture log
             log = (td / "eq.log").read_text(errors="ignore") if (td / "eq.log").exists() else ""
@@ -126,52 +181,127 @@ def _latex_render(expr: str, out_path: str, dpi: int = 300, packages=None):
         if not pdf_file.exists():
             raise RuntimeError("pdflatex did not produce eq.pdf")
 
-        # convert to PNG using pdf2image
-        pages = convert_from_path(str(pdf_file), dpi=dpi, fmt="png")
+        # rasterize with pdf2image; without an output folder pdftoppm streams to us
+        # over a pipe, and uncompressed PPM avoids a PNG encode + decode per page
+        pages = convert_from_path(str(pdf_file), dpi=dpi, fmt="ppm", single_file=single_file)
         if len(pages) == 0:
             raise RuntimeError("pdf2image did not return any pages")
-        pages[0].convert("RGB").save(out_path)
+        return [page.convert("RGB") for page in pages]
+
+
+def _run_pdflatex(preamble: str, body: str, dpi: int, single_file: bool = False) -> list:
+    """Compile preamble + body once and return every page (only the first with single_file) as an RGB image."""
+    fmt = _preamble_format(preamble)
+    try:
+        return _compile_pdflatex(preamble, body, dpi, single_file, fmt)
+    except RuntimeError:
+        if fmt is None:
+            raise
+        # don't let a bad format turn into a render failure: retry with the full preamble
+        return _compile_pdflatex(preamble, body, dpi, single_file, None)
+
+
+def _latex_render(expr: str, out_path: str = None, dpi: int = 300, packages=None):
+    """
+    Render expression using pdflatex -> pdf -> png.
+    Returns the RGB image when out_path is None, otherwise saves it and returns out_path.
+
+    Uses the standalone documentclass (tight bounding) and ensures the expression
+    is placed inside math mode when appropriate (especially for \\begin{...}).
+    """
+    _check_latex_tools()
+    packages = packages or ["amsmath", "amssymb", "amsfonts", "bm"]
+
+    preamble = r"""\documentclass[varwidth=true, border=2pt]{standalone}
+\usepackage{%s}
+""" % ",".join(packages)
+    body = r"""\begin{document}
+%s
+\end{document}
+""" % _math_block(expr)
+
+    img = _run_pdflatex(preamble, body, dpi, single_file=True)[0]
+    if out_path is None:
+        return img
+    img.save(out_path)
     return out_path
 
 
+def _latex_render_batch(exprs, dpi: int = 300, packages=None) -> list:
+    """
+    Render many expressions with a single pdflatex run (one cropped page per
+    expression via standalone's multi mode) and return one RGB image per expr.
 
+    pdflatex startup dominates the per-expression cost, so this amortizes it
+    over the whole batch. One bad expression fails the whole batch
+    (-halt-on-error); callers should fall back to _latex_render per expr.
+    """
+    _check_latex_tools()
+    packages = packages or ["amsmath", "amssymb", "amsfonts", "bm"]
+    exprs = list(exprs)
+    if not exprs:
+        return []
 
-def render_mathtext(expr: str, out_path: str, dpi: int = 200, fontsize: int = 28, prefer_latex: bool = False):
+    preamble = r"""\documentclass[varwidth=true, border=2pt, multi]{standalone}
+\usepackage{%s}
+""" % ",".join(packages)
+    body = r"""\begin{document}
+%s
+\end{document}
+""" % "\n".join("\\begin{standalone}\n%s\n\\end{standalone}" % _math_block(e) for e in exprs)
+
+    images = _run_pdflatex(preamble, body, dpi)
+    if len(images) != len(exprs):
+        raise RuntimeError(f"expected {len(exprs)} pages from pdflatex, got {len(images)}")
+    return images
+
+
+def needs_full_latex(expr: str) -> bool:
+    """Heuristic: expressions with LaTeX environments or multi-line constructs need pdflatex."""
+    return "\\begin" in expr or "\\matrix" in expr or "\\begin{" in expr or "\n" in expr or "\\displaystyle" in expr or "\\cases" in expr or "\\align" in expr
+
+
+def render_mathtext_image(expr: str, dpi: int = 200, fontsize: int = 28, prefer_latex: bool = False) -> Image.Image:
     """
-    Render a LaTeX expression to out_path (PNG).
+    Render a LaTeX expression to an in-memory RGB PIL image.
 
     - expr: LaTeX expression (e.g., '\\nabla \\cdot E = \\rho/\\varepsilon_0' or '\\begin{pmatrix} ...')
-    - out_path: target png path
     - dpi: resolution for rendering
     - fontsize: used for matplotlib route
     - prefer_latex: if True, always try pdflatex route; otherwise autodetect
     """
-    out_path = str(out_path)
-    # heuristics: if expression contains a LaTeX environment, or multi-line constructs, use pdflatex
-    needs_full_latex = "\\begin" in expr or "\\matrix" in expr or "\\begin{" in expr or "\n" in expr or "\\displaystyle" in expr or "\\cases" in expr or "\\align" in expr
-
-    if prefer_latex or needs_full_latex:
+    if prefer_latex or needs_full_latex(expr):
         try:
-            return _latex_render(expr, out_path, dpi=max(dpi, 300))
+            return _latex_render(expr, dpi=max(dpi, 300))
         except Exception as e:
             logger.warning("LaTeX render failed (%s); falling back to matplotlib if possible. Error: %s", type(e).__name__, e)
             # fall back to matplotlib below
 
     # Try matplotlib route
     try:
-        return _matplotlib_render(expr, out_path, dpi=dpi, fontsize=fontsize)
+        return _matplotlib_render(expr, dpi=dpi, fontsize=fontsize)
     except Exception as e:
         # If matplotlib can't render and pdflatex is available, try latex route
         logger.warning("Matplotlib mathtext failed (%s). Trying full LaTeX if available. Error: %s", type(e).__name__, e)
-        if shutil.which("pdflatex") and HAVE_PDF2IMAGE:
-            return _latex_render(expr, out_path, dpi=max(dpi, 300))
+        if _pdflatex_path() and HAVE_PDF2IMAGE:
+            return _latex_render(expr, dpi=max(dpi, 300))
         else:
             raise
 
 
+def render_mathtext(expr: str, out_path: str, dpi: int = 200, fontsize: int = 28, prefer_latex: bool = False):
+    """
+    Render a LaTeX expression to out_path (PNG); see render_mathtext_image for the arguments.
+    """
+    out_path = str(out_path)
+    render_mathtext_image(expr, dpi=dpi, fontsize=fontsize, prefer_latex=prefer_latex).save(out_path)
+    return out_path
+
+
 # small demo: create a synthetic page by pasting multiple rendered expressions
-def make_synthetic_page(out_dir, page_name="page_0001.png", n_eq=5, dpi=150):
+def make_synthetic_page(out_dir, page_name="page_0001.png", n_eq=5, dpi=150, seed=None):
     from PIL import Image, ImageDraw
+    rng = np.random.default_rng(seed)
     out_dir = Path(out_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
     page_width, page_height = 1240, 1754  # A4-ish at medium DPI
@@ -184,28 +314,30 @@ def make_synthetic_page(out_dir, page_name="page_0001.png", n_eq=5, dpi=150):
             # correct matrix expression (single backslashes for LaTeX row separator)
             expr = r"\begin{pmatrix} a & b \\ c & d \end{pmatrix}"
             prefer_latex = True
-        tmp = out_dir / f"tmp_eq_{i}.png"
-        render_mathtext(expr, str(tmp), dpi=dpi, prefer_latex=prefer_latex)
-        eq = Image.open(tmp)
+        eq = render_mathtext_image(expr, dpi=dpi, prefer_latex=prefer_latex)
         # random paste location
-        import random
         maxx = page_width - eq.width - 50
         maxy = page_height - eq.height - 50
-        x = random.randint(50, max(50, maxx))
-        y = random.randint(50, max(50, maxy))
+        x, y = rng.integers(50, [max(50, maxx), max(50, maxy)], endpoint=True).tolist()
         bg.paste(eq, (x, y))
     out_path = out_dir / page_name
     bg.save(out_path)
     return out_path
 
 
+def _render_one(i, out_dir):
+    """Build synthetic page i; top-level so ProcessPoolExecutor can pickle it."""
+    return make_synthetic_page(out_dir, page_name=f"page_{i:04d}.png")
+
+
 if __name__ == "__main__":
     p = argparse.ArgumentParser()
     p.add_argument("--out-dir", default="detector/data/images/synth", help="Output directory")
     p.add_argument("--n", default=20, type=int, help="Number of synthetic pages")
+    p.add_argument("--workers", default=None, type=int, help="Worker processes (default: all cores)")
     args = p.parse_args()
     os.makedirs(args.out_dir, exist_ok=True)
-    for i in range(args.n):
-        name = f"page_{i:04d}.png"
-        make_synthetic_page(args.out_dir, page_name=name)
+    # each worker process has its own matplotlib/pyplot state
+    with ProcessPoolExecutor(max_workers=args.workers) as ex:
+        list(ex.map(partial(_render_one, out_dir=args.out_dir), range(args.n), chunksize=4))
     print("Generated synthetic pages in", args.out_dir)
@@ -14,14 +14,54 @@ Usage:
 """
 import json
 import argparse
+import os
 import random
 import re
+from collections import defaultdict
 from pathlib import Path
 from typing import Dict, List, Tuple
 
+# Optional fast JSON codec
+try:
+    import orjson
+    HAVE_ORJSON = True
+except Exception:
+    HAVE_ORJSON = False
+
 PAPER_REGEX = re.compile(r"^(.+?)_page_\d{1,4}\.")  # matches paperid_page_0001.png
 
 
+def _load_json(path: Path):
+    if HAVE_ORJSON:
+        return orjson.loads(Path(path).read_bytes())
+    return json.loads(Path(path).read_text(encoding="utf-8"))
+
+
+def _dumps(obj, pretty: bool = False) -> bytes:
+    """Encode obj to JSON bytes; compact unless pretty (indent=2) is requested."""
+    if HAVE_ORJSON:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if pretty else 0)
+    if pretty:
+        return json.dumps(obj, indent=2).encode("utf-8")
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def _write_coco(path: Path, shared: Dict, shared_prefix: bytes, images: List[Dict], annotations: List[Dict],
+                pretty: bool = False):
+    """
+    Write one COCO file with a single write call. In compact mode the shared
+    info/licenses/categories are spliced in from the pre-encoded `shared_prefix`
+    (the encoded dict minus its closing brace) instead of being re-encoded.
+    """
+    if pretty:
+        payload = _dumps({**shared, "images": images, "annotations": annotations}, pretty=True)
+    else:
+        payload = (shared_prefix + b',"images":' + _dumps(images)
+                   + b',"annotations":' + _dumps(annotations) + b"}")
+    with open(path, "wb") as fh:
+        fh.write(payload)
+
+
 def infer_paper_from_filename(fname: str) -> str:
     """Try multiple heuristic patterns to obtain a paper_id from an image filename."""
     base = Path(fname).name
@@ -38,8 +78,22 @@ def infer_paper_from_filename(fname: str) -> str:
     return p.stem
 
 
-def split_coco_by_paper(coco_in: Path, out_dir: Path, val_frac: float = 0.2, seed: int = 0):
-    coco = json.load(open(coco_in, "r", encoding="utf-8"))
+def infer_papers_from_filenames(fnames: List[str]) -> List[str]:
+    """
+    Batch form of infer_paper_from_filename: one regex pass over the basenames,
+    building Path objects only for names the regex does not match.
+    """
+    match = PAPER_REGEX.match
+    basename = os.path.basename
+    out = []
+    for fname in fnames:
+        m = match(basename(fname))
+        out.append(m.group(1) if m else infer_paper_from_filename(fname))
+    return out
+
+
+def split_coco_by_paper(coco_in: Path, out_dir: Path, val_frac: float = 0.2, seed: int = 0, pretty: bool = False):
+    coco = _load_json(coco_in)
     images = coco.get("images", [])
     annotations = coco.get("annotations", [])
     categories = coco.get("categories", [])
@@ -48,54 +102,50 @@ def split_coco_by_paper(coco_in: Path, out_dir: Path, val_frac: float = 0.2, see
     images_by_id: Dict[int, Dict] = {img["id"]: img for img in images}
 
     # group image ids by paper
-    paper_to_image_ids: Dict[str, List[int]] = {}
-    for img in images:
-        paper_id = infer_paper_from_filename(img["file_name"])
-        paper_to_image_ids.setdefault(paper_id, []).append(img["id"])
+    paper_to_image_ids: Dict[str, List[int]] = defaultdict(list)
+    paper_ids = infer_papers_from_filenames([img["file_name"] for img in images])
+    for img, paper_id in zip(images, paper_ids):
+        paper_to_image_ids[paper_id].append(img["id"])
 
     # shuffle and split papers
     papers = list(paper_to_image_ids.keys())
     random.Random(seed).shuffle(papers)
     nval = max(1, int(len(papers) * val_frac))
-    val_papers = set(papers[:nval])
-    train_papers = set(papers[nval:])
-
-    def build_subset(paperset):
-        out_images = []
-        out_annotations = []
-        image_ids = set()
-        for paper in paperset:
-            ids = paper_to_image_ids.get(paper, [])
-            for iid in ids:
+    val_papers = papers[:nval]
+    train_papers = papers[nval:]
+
+    # map each image to its split once (0=train, 1=val), then partition the
+    # annotations in a single pass instead of one pass per subset
+    TRAIN, VAL = 0, 1
+    id_to_split: Dict[int, int] = {}
+    train_images, val_images = [], []
+    for split, paperlist, out_images in ((TRAIN, train_papers, train_images), (VAL, val_papers, val_images)):
+        for paper in paperlist:
+            for iid in paper_to_image_ids.get(paper, []):
                 out_images.append(images_by_id[iid])
-                image_ids.add(iid)
-        for ann in annotations:
-            if ann["image_id"] in image_ids:
-                out_annotations.append(ann)
-        return out_images, out_annotations
-
-    train_images, train_annotations = build_subset(train_papers)
-    val_images, val_annotations = build_subset(val_papers)
-
-    train_coco = {
-        "info": coco.get("info", {}),
-        "licenses": coco.get("licenses", []),
-        "images": train_images,
-        "annotations": train_annotations,
-        "categories": categories,
-    }
-    val_coco = {
+                id_to_split[iid] = split
+
+    train_annotations, val_annotations = [], []
+    for ann in annotations:
+        split = id_to_split.get(ann["image_id"])
+        if split == TRAIN:
+            train_annotations.append(ann)
+        elif split == VAL:
+            val_annotations.append(ann)
+
+    # info/licenses/categories are identical in both outputs: build them once
+    # and encode them once
+    shared = {
         "info": coco.get("info", {}),
         "licenses": coco.get("licenses", []),
-        "images": val_images,
-        "annotations": val_annotations,
         "categories": categories,
     }
+    shared_prefix = _dumps(shared)[:-1]  # drop the closing brace
     out_dir.mkdir(parents=True, exist_ok=True)
     train_path = out_dir / "instances_train.json"
     val_path = out_dir / "instances_val.json"
-    json.dump(train_coco, open(train_path, "w", encoding="utf-8"), indent=2)
-    json.dump(val_coco, open(val_path, "w", encoding="utf-8"), indent=2)
+    _write_coco(train_path, shared, shared_prefix, train_images, train_annotations, pretty=pretty)
+    _write_coco(val_path, shared, shared_prefix, val_images, val_annotations, pretty=pretty)
     print(f"Wrote: {train_path} ({len(train_images)} images, {len(train_annotations)} anns)")
     print(f"Wrote: {val_path} ({len(val_images)} images, {len(val_annotations)} anns)")
     return train_path, val_path
@@ -107,8 +157,9 @@ def main():
     p.add_argument("--out-dir", required=True, help="Output directory for instances_train.json / instances_val.json")
     p.add_argument("--val-frac", default=0.2, type=float)
     p.add_argument("--seed", default=0, type=int)
+    p.add_argument("--pretty", action="store_true", help="Indent output JSON (larger, slower; for debugging)")
     args = p.parse_args()
-    split_coco_by_paper(Path(args.coco), Path(args.out_dir), args.val_frac, args.seed)
+    split_coco_by_paper(Path(args.coco), Path(args.out_dir), args.val_frac, args.seed, pretty=args.pretty)
 
 
 if __name__ == "__main__":
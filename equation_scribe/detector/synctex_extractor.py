@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-"""
+r"""
 detector/synctex_extractor.py
 
 Given a LaTeX source file (main.tex), this script:
@@ -24,90 +24,124 @@ import json
 import tempfile
 import shutil
 import sys
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
-DISPLAY_BEGIN_RE = re.compile(r'\\\\begin\\{(equation|align|align\\*|equation\\*|gather|multline)\\}')
-DISPLAY_END_RE = re.compile(r'\\\\end\\{(equation|align|align\\*|equation\\*|gather|multline)\\}')
-DOLLAR_DISPLAY_RE = re.compile(r'\\$\\$(.*?)\\$\\$', re.S)
-BRACKET_RE = re.compile(r'\\\\\\[(.*?)\\\\\\]', re.S)
+DISPLAY_BEGIN_RE = re.compile(r'\\begin\{(equation\*?|align\*?|gather|multline)\}')
+DISPLAY_END_RE = re.compile(r'\\end\{(equation\*?|align\*?|gather|multline)\}')
+DOLLAR_DISPLAY_RE = re.compile(r'\$\$(.*?)\$\$', re.S)
+BRACKET_RE = re.compile(r'\\\[(.*?)\\\]', re.S)
+# tokens find_display_regions cares about; kept as two patterns with a literal
+# first character so the regex engine can skip ahead instead of testing every char
+DISPLAY_TOKEN_RE = re.compile(r'\\(?:(?:begin|end)\{(?:equation\*?|align\*?|gather|multline)\}|\[|\])')
+DOUBLE_DOLLAR_RE = re.compile(r'\$\$')
+# one pass over `synctex view` output; each match fills exactly one of the groups
+SYNCTEX_FIELD_RE = re.compile(r'\b(?:page\s*[:=]?\s*(\d+)|x\s*[:=]\s*([0-9.+-]+)|y\s*[:=]\s*([0-9.+-]+))', re.I)
 
 def find_display_regions(tex_path: Path):
     """
-    Parse tex file line-by-line and extract display math regions.
-    Return list of (start_line, end_line, latex_text).
+    Extract display math regions from a tex file.
+    Return list of (start_line, end_line, latex_text) with whole source lines.
+
+    The whole file is scanned with DISPLAY_TOKEN_RE and DOUBLE_DOLLAR_RE; only
+    lines holding a token are visited afterwards, so plain text lines cost nothing.
     """
-    regions = []
-    with tex_path.open('r', encoding='utf-8', errors='ignore') as fh:
-        lines = fh.readlines()
+    text = tex_path.read_text(encoding='utf-8', errors='ignore')
+    n_lines = text.count('\n') + (1 if text and not text.endswith('\n') else 0)
+
+    # per line: [has \begin, has \end, has \[, has \], number of $$, offset of a token]
+    tokens = {}
+    for regex in (DISPLAY_TOKEN_RE, DOUBLE_DOLLAR_RE):
+        line, pos = 0, 0
+        for m in regex.finditer(text):
+            line += text.count('\n', pos, m.start())
+            pos = m.start()
+            flags = tokens.get(line)
+            if flags is None:
+                flags = tokens[line] = [False, False, False, False, 0, pos]
+            tok = m.group(0)
+            if tok == '$$':
+                flags[4] += 1
+            elif tok == '\\[':
+                flags[2] = True
+            elif tok == '\\]':
+                flags[3] = True
+            elif tok.startswith('\\begin'):
+                flags[0] = True
+            else:
+                flags[1] = True
+    token_lines = sorted(tokens)
 
-    # 1) find \begin{...} ... \end{...}
+    def line_span(first, last):
+        lo = text.rfind('\n', 0, tokens[first][5]) + 1
+        hi = text.find('\n', tokens[last][5]) + 1 if last in tokens else 0
+        return text[lo:hi or len(text)]
+
+    regions = []
     i = 0
-    while i < len(lines):
-        m = DISPLAY_BEGIN_RE.search(lines[i])
-        if m:
-            start = i
-            # find matching \end
-            j = i
+    for k, line in enumerate(token_lines):
+        if line < i:
+            continue
+        has_begin, _, has_open, _, n_dollar, _ = tokens[line]
+        # 1) find \begin{...} ... \end{...}
+        if has_begin:
             depth = 0
-            while j < len(lines):
-                if DISPLAY_BEGIN_RE.search(lines[j]):
+            for kk in range(k, len(token_lines)):
+                other = token_lines[kk]
+                if tokens[other][0]:
                     depth += 1
-                if DISPLAY_END_RE.search(lines[j]):
+                if tokens[other][1]:
                     depth -= 1
                     if depth <= 0:
-                        end = j
+                        regions.append((line + 1, other + 1, line_span(line, other)))
+                        i = other + 1
                         break
-                j += 1
             else:
-                # not found; break
-                i += 1
-                continue
-            latex = ''.join(lines[start:end+1])
-            regions.append((start+1, end+1, latex))
-            i = end + 1
+                # not found; move on to the next line
+                i = line + 1
             continue
         # check for \[ ... \]
-        if '\\[' in lines[i]:
-            start = i
-            j = i
-            found = False
-            buf = []
-            while j < len(lines):
-                buf.append(lines[j])
-                if '\\]' in lines[j]:
-                    found = True
-                    break
-                j += 1
-            if found:
-                latex = ''.join(buf)
-                regions.append((start+1, j+1, latex))
-                i = j + 1
+        if has_open:
+            close = next((token_lines[kk] for kk in range(k, len(token_lines))
+                          if tokens[token_lines[kk]][3]), None)
+            if close is not None:
+                regions.append((line + 1, close + 1, line_span(line, close)))
+                i = close + 1
                 continue
-        # check for $$ ... $$
-        if '$$' in lines[i]:
-            start = i
-            j = i
-            buf = []
-            cnt = lines[i].count('$$')
-            # if odd count, we opened
-            if cnt % 2 == 1:
-                buf.append(lines[i])
-                j = i + 1
-                while j < len(lines):
-                    buf.append(lines[j])
-                    if lines[j].count('$$') % 2 == 1:
-                        break
-                    j += 1
-                latex = ''.join(buf)
-                regions.append((start+1, j+1, latex))
-                i = j + 1
-                continue
-        i += 1
+        # check for $$ ... $$ (an odd count on the line opens a block; unclosed runs to EOF)
+        if n_dollar % 2 == 1:
+            close = next((token_lines[kk] for kk in range(k + 1, len(token_lines))
+                          if tokens[token_lines[kk]][4] % 2 == 1), n_lines)
+            regions.append((line + 1, close + 1, line_span(line, close)))
+            i = close + 1
     return regions
 
 def compile_with_synctex(tex_path: Path, workdir: Path):
     cmd = ['pdflatex', '-synctex=1', '-interaction=nonstopmode', '-halt-on-error', '-output-directory', str(workdir), str(tex_path)]
     subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
+def _parse_synctex_output(out: str):
+    """
+    Pull (page, x, y) out of `synctex view` output: one field per line
+    ('Page:5', 'x:123.4', 'y:456.7') or 'Output:Page: 5; x: 123.4; y: 456.7'.
+    When several result blocks are printed the last value of each field wins.
+    """
+    page = None
+    x = y = None
+    for m in SYNCTEX_FIELD_RE.finditer(out):
+        p, mx, my = m.groups()
+        try:
+            if p is not None:
+                page = int(p)
+            elif mx is not None:
+                x = float(mx)
+            else:
+                y = float(my)
+        except ValueError:
+            pass
+    return page, x, y
+
 def synctex_view(pdf_path: Path, tex_path: Path, line: int):
     """
     Call synctex to map source line -> pdf coordinates.
@@ -121,43 +155,13 @@ def synctex_view(pdf_path: Path, tex_path: Path, line: int):
     cmd = [synctex_cmd, 'view', '-i', query, '-o', str(pdf_path)]
     p = subprocess.run(cmd, check=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
     out = p.stdout + p.stderr
-    # parse output: look for 'Output:' or 'Result' lines. Format can vary; we'll try to find 'Page:' and coords
-    # Example synctex output lines: 'Output:Page: 5; x: 123.4; y: 456.7; h: ...'
-    page = None
-    x = y = None
-    for line in out.splitlines():
-        line = line.strip()
-        if line.lower().startswith('page:') or 'page:' in line.lower():
-            # naive parse
-            parts = line.replace(';', ' ').replace(':', ' : ').split()
-            # find page number after 'page :'
-            try:
-                idx = parts.index('page') if 'page' in parts else (parts.index('Page') if 'Page' in parts else -1)
-                if idx >= 0:
-                    page = int(parts[idx+2])
-            except Exception:
-                pass
-        # fallback: some implementations print 'Output: x y h v page n'
-        m = re.search(r'Page\\s*[:=]?\\s*(\\d+)', line, flags=re.I)
-        if m:
-            page = int(m.group(1))
-        # coords (x,y)
-        m2 = re.search(r'x\\s*[:=]?\\s*([0-9.+-]+)', line, flags=re.I)
-        m3 = re.search(r'y\\s*[:=]?\\s*([0-9.+-]+)', line, flags=re.I)
-        if m2:
-            try:
-                x = float(m2.group(1))
-            except: pass
-        if m3:
-            try:
-                y = float(m3.group(1))
-            except: pass
+    page, x, y = _parse_synctex_output(out)
     if page is None:
         return None
     # synctex often returns an (x,y) in points; we return what we have
     return {"page": page-1 if page>0 else 0, "x": x, "y": y, "raw": out}
 
-def extract_synctex_pairs(tex_path: Path, out_jsonl: Path, workdir: Path = None):
+def extract_synctex_pairs(tex_path: Path, out_jsonl: Path, workdir: Path = None, workers: int = None):
     tex_path = Path(tex_path)
     pdf_candidate = tex_path.with_suffix('.pdf')
     with tempfile.TemporaryDirectory() as td:
@@ -175,10 +179,14 @@ def extract_synctex_pairs(tex_path: Path, out_jsonl: Path, workdir: Path = None)
 
         regions = find_display_regions(tex_path)
         out_jsonl.parent.mkdir(parents=True, exist_ok=True)
-        with open(out_jsonl, 'w', encoding='utf-8') as fh:
-            for (start_line, end_line, latex) in regions:
-                # use start_line as anchor
-                mapping = synctex_view(pdf_path, tex_path, start_line)
+        # synctex queries are independent subprocesses: run them concurrently
+        # (threads suffice, each one just waits on its child) and keep region order
+        query = partial(synctex_view, pdf_path, tex_path)
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as ex, \
+                open(out_jsonl, 'w', encoding='utf-8') as fh:
+            # use start_line as anchor
+            mappings = ex.map(query, [start_line for (start_line, _, _) in regions])
+            for (start_line, end_line, latex), mapping in zip(regions, mappings):
                 if mapping is None:
                     print(f'No synctex mapping for lines {start_line}-{end_line}; skipping')
                     continue
@@ -192,15 +200,16 @@ def extract_synctex_pairs(tex_path: Path, out_jsonl: Path, workdir: Path = None)
                     "end_line": end_line,
                     "raw_synctex": mapping.get("raw")
                 }
-                fh.write(json.dumps(rec, ensure_ascii=False) + '\\n')
+                fh.write(json.dumps(rec, ensure_ascii=False) + '\n')
         print(f'Wrote synctex pairs to {out_jsonl}')
 
 def main():
     p = argparse.ArgumentParser()
     p.add_argument('--tex', required=True, help='Path to main .tex file')
     p.add_argument('--out', required=True, help='Output JSONL with extracted pairs')
+    p.add_argument('--workers', type=int, default=None, help='Concurrent synctex queries (default: number of cores)')
     args = p.parse_args()
-    extract_synctex_pairs(Path(args.tex), Path(args.out))
+    extract_synctex_pairs(Path(args.tex), Path(args.out), workers=args.workers)
 
 if __name__ == '__main__':
     main()
@@ -15,27 +15,92 @@ Usage:
 from pathlib import Path
 import argparse
 import json
-import random
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
 from PIL import Image
 
-# import render_mathtext from render_latex (must be in detector/)
-from detector.render_latex import render_mathtext
+# Optional fast JSON encoder
+try:
+    import orjson
+    HAVE_ORJSON = True
+except Exception:
+    HAVE_ORJSON = False
+
+# import render_mathtext_image from render_latex (must be in detector/)
+from detector.render_latex import render_mathtext_image, needs_full_latex, _latex_render_batch
+
+def _write_json(path: Path, obj, pretty: bool = False):
+    """Write obj as UTF-8 JSON in one binary write (orjson when available); compact unless pretty."""
+    if HAVE_ORJSON:
+        payload = orjson.dumps(obj, option=orjson.OPT_INDENT_2 if pretty else 0)
+    elif pretty:
+        payload = json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+    else:
+        payload = json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    with Path(path).open("wb") as fh:
+        fh.write(payload)
 
 def bbox_to_coco(x0, y0, x1, y1):
     w = max(0.0, x1 - x0)
     h = max(0.0, y1 - y0)
     return [float(x0), float(y0), float(w), float(h)]
 
+def _render_eq(expr: str, dpi: int, prefer_latex: bool):
+    """Render expr to an in-memory image, or return None if rendering fails."""
+    try:
+        return render_mathtext_image(expr, dpi=dpi, prefer_latex=prefer_latex)
+    except Exception:
+        # fallback to matplotlib rendering if pdflatex or pdf2image fails
+        try:
+            return render_mathtext_image(expr, dpi=dpi, prefer_latex=False)
+        except Exception as e:
+            print("Skipping expr; render failed:", expr, e)
+            return None
+
+def _prefer_latex(expr: str) -> bool:
+    return "\\begin" in expr or "\n" in expr or "\\\\[" in expr
+
+def _prerender_latex(pool, dpi: int, cache: dict):
+    """Render every pool expression that takes the pdflatex route in one pdflatex run."""
+    keys = [(expr, dpi, _prefer_latex(expr)) for expr in dict.fromkeys(pool)]
+    keys = [key for key in keys if key[2] or needs_full_latex(key[0])]
+    if not keys:
+        return
+    try:
+        # same resolution render_mathtext_image uses for the LaTeX route
+        images = _latex_render_batch([key[0] for key in keys], dpi=max(dpi, 300))
+    except Exception:
+        # no TeX toolchain or one bad expression: render lazily one by one instead
+        return
+    cache.update(zip(keys, images))
+
+def _make_one_page(page, out_images_dir: Path, eq_arrays: dict, page_w: int, page_h: int):
+    """Composite one laid-out page and write its PNG and .meta.json (module level so it pickles)."""
+    page_name, placements, page_records = page
+    page_path = out_images_dir / page_name
+    bg = np.full((page_h, page_w), 255, dtype=np.uint8)
+    for key, x, y in placements:
+        arr = eq_arrays[key]
+        # clip at the page edge like Image.paste does for oversized equations
+        eh, ew = min(arr.shape[0], page_h - y), min(arr.shape[1], page_w - x)
+        bg[y:y + eh, x:x + ew] = arr[:eh, :ew]
+
+    # Save page and page-level metadata file
+    Image.fromarray(bg).save(page_path)
+    meta = {"file_name": str(page_path), "width": page_w, "height": page_h, "eqs": page_records}
+    meta_path = page_path.with_suffix(".meta.json")
+    _write_json(meta_path, meta, pretty=True)
+    return page_path
+
 def make_synthetic_dataset(out_images_dir: Path, out_annotations: Path,
-                           n_pages: int = 50, eqs_per_page: int = 5, dpi: int = 150):
+                           n_pages: int = 50, eqs_per_page: int = 5, dpi: int = 150,
+                           workers: int = None):
     out_images_dir.mkdir(parents=True, exist_ok=True)
-    annotations = []
     images = []
     categories = [{"id":1, "name":"display"}, {"id":2, "name":"inline"}]
 
-    image_id = 1
-    ann_id = 1
-
     pool = [
         r"E = mc^2",
         r"\nabla \cdot \mathbf{E} = \rho / \varepsilon_0",
@@ -49,65 +114,80 @@ def make_synthetic_dataset(out_images_dir: Path, out_annotations: Path,
         r"\left( \frac{\partial^2}{\partial x^2} + \frac{\partial^2}{\partial y^2} \right) u = 0",
     ]
 
-    random.seed(0)
-
+    rng = np.random.default_rng(0)
+    cache = {}
+    _prerender_latex(pool, dpi, cache)
+    page_w, page_h = 1240, 1754
+
+    # Lay out every page up front so the random sequence (and hence the dataset)
+    # does not depend on how many workers composite and save the pages.
+    # All expression choices are drawn in one call ...
+    expr_idx = rng.integers(0, len(pool), size=(n_pages, eqs_per_page))
+    keys = [(expr, dpi, _prefer_latex(expr)) for expr in pool]
+    for i in np.unique(expr_idx).tolist():
+        # render each distinct expression once; failures are cached as None and skipped
+        if keys[i] not in cache:
+            cache[keys[i]] = _render_eq(pool[i], dpi, keys[i][2])
+    rendered = [cache.get(key) is not None for key in keys]
+    sizes = np.array([cache[key].size if ok else (0, 0) for key, ok in zip(keys, rendered)]).reshape(-1, 2)
+
+    # ... and, once render sizes are known, every position in one call per axis
+    ew, eh = sizes[expr_idx, 0], sizes[expr_idx, 1]
+    xs = rng.integers(60, np.maximum(60, page_w - ew - 60), endpoint=True)
+    ys = rng.integers(60, np.maximum(60, page_h - eh - 60), endpoint=True)
+
+    pages = []
     for pg in range(n_pages):
         page_name = f"page_{pg:04d}.png"
-        page_path = out_images_dir / page_name
-        page_w, page_h = 1240, 1754
-        bg = Image.new("RGB", (page_w, page_h), "white")
-
+        placements = []
         page_records = []
-        for i in range(eqs_per_page):
-            expr = random.choice(pool)
-            tmp_png = out_images_dir / f"tmp_{pg}_{i}.png"
-            prefer_latex = "\\begin" in expr or "\n" in expr or "\\\\[" in expr
-            try:
-                render_mathtext(expr, str(tmp_png), dpi=dpi, prefer_latex=prefer_latex)
-            except Exception:
-                # fallback to matplotlib rendering if pdflatex or pdf2image fails
-                try:
-                    render_mathtext(expr, str(tmp_png), dpi=dpi, prefer_latex=False)
-                except Exception as e:
-                    print("Skipping expr; render failed:", expr, e)
-                    continue
-            eq_img = Image.open(tmp_png)
-            ew, eh = eq_img.size
-            maxx = max(60, page_w - ew - 60)
-            maxy = max(60, page_h - eh - 60)
-            x = random.randint(60, maxx)
-            y = random.randint(60, maxy)
-            bg.paste(eq_img, (x, y))
-
-            x0, y0, x1, y1 = float(x), float(y), float(x + ew), float(y + eh)
-            page_records.append({"latex": expr, "bbox": [x0, y0, x1, y1], "type": "display"})
-            try:
-                tmp_png.unlink()
-            except Exception:
-                pass
-
-        # Save page and page-level metadata file
-        bg.save(page_path)
-        meta = {"file_name": str(page_path), "width": page_w, "height": page_h, "eqs": page_records}
-        meta_path = page_path.with_suffix(".meta.json")
-        meta_path.write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
-
-        # Append image record and annotations to COCO lists
+        for i, x, y, w, h in zip(expr_idx[pg].tolist(), xs[pg].tolist(), ys[pg].tolist(),
+                                 ew[pg].tolist(), eh[pg].tolist()):
+            if not rendered[i]:
+                continue
+            placements.append((keys[i], x, y))
+
+            x0, y0, x1, y1 = float(x), float(y), float(x + w), float(y + h)
+            page_records.append({"latex": pool[i], "bbox": [x0, y0, x1, y1], "type": "display"})
+        pages.append((page_name, placements, page_records))
+
+    # paste from plain uint8 arrays: one slice assignment per equation. Renders are
+    # black-on-white, so pages are single-channel ("L") rather than RGB.
+    eq_arrays = {key: np.asarray(img.convert("L")) for key, img in cache.items() if img is not None}
+    worker = partial(_make_one_page, out_images_dir=out_images_dir, eq_arrays=eq_arrays,
+                     page_w=page_w, page_h=page_h)
+    workers = min(workers or os.cpu_count() or 1, max(n_pages, 1))
+    if workers == 1:
+        for page in pages:
+            worker(page)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            list(ex.map(worker, pages, chunksize=4))
+
+    image_ids, cat_ids, boxes = [], [], []
+    for image_id, (page_name, _, page_records) in enumerate(pages, start=1):
+        page_path = out_images_dir / page_name
+        # Append image record; annotations are built for all pages at once below
         images.append({"id": image_id, "file_name": str(page_path), "width": page_w, "height": page_h})
         for rec in page_records:
-            x0, y0, x1, y1 = rec["bbox"]
-            coco_bbox = bbox_to_coco(x0, y0, x1, y1)
-            annotations.append({
-                "id": ann_id,
-                "image_id": image_id,
-                "category_id": 1 if rec.get("type") == "display" else 2,
-                "bbox": coco_bbox,
-                "area": coco_bbox[2] * coco_bbox[3],
-                "iscrowd": 0,
-                "segmentation": []
-            })
-            ann_id += 1
-        image_id += 1
+            image_ids.append(image_id)
+            cat_ids.append(1 if rec.get("type") == "display" else 2)
+            boxes.append(rec["bbox"])
+
+    # same arithmetic as bbox_to_coco, over every box in one go
+    xyxy = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    coco_bboxes = np.column_stack([xyxy[:, :2], np.maximum(xyxy[:, 2:] - xyxy[:, :2], 0.0)])
+    areas = coco_bboxes[:, 2] * coco_bboxes[:, 3]
+    annotations = [{
+        "id": ann_id,
+        "image_id": image_id,
+        "category_id": cat_id,
+        "bbox": bbox,
+        "area": area,
+        "iscrowd": 0,
+        "segmentation": []
+    } for ann_id, image_id, cat_id, bbox, area in zip(
+        range(1, len(boxes) + 1), image_ids, cat_ids, coco_bboxes.tolist(), areas.tolist())]
 
     coco = {"info": {"description": "Synthetic equation dataset"},
             "licenses": [],
@@ -115,8 +195,8 @@ def make_synthetic_dataset(out_images_dir: Path, out_annotations: Path,
             "annotations": annotations,
             "categories": categories}
     out_annotations.parent.mkdir(parents=True, exist_ok=True)
-    with open(out_annotations, "w", encoding="utf-8") as fh:
-        json.dump(coco, fh, indent=2)
+    # compact: pretty-printing dominates the dump at 100k+ annotations
+    _write_json(out_annotations, coco)
     print(f"Wrote {len(images)} images and {len(annotations)} annotations to {out_annotations}")
 
 def main():
@@ -126,9 +206,11 @@ def main():
     p.add_argument("--n-pages", type=int, default=50)
     p.add_argument("--eqs-per-page", type=int, default=5)
     p.add_argument("--dpi", type=int, default=150)
+    p.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
     args = p.parse_args()
     make_synthetic_dataset(Path(args.out_images), Path(args.out_anns),
-                           n_pages=args.n_pages, eqs_per_page=args.eqs_per_page, dpi=args.dpi)
+                           n_pages=args.n_pages, eqs_per_page=args.eqs_per_page, dpi=args.dpi,
+                           workers=args.workers)
 
 if __name__ == "__main__":
     main()
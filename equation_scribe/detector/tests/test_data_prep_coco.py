@@ -0,0 +1,51 @@
+import json
+from pathlib import Path
+from PIL import Image
+from detector.data_prep_coco import convert_profiles_to_coco
+
+def make_profiles(tmp_path: Path):
+    profiles = tmp_path / "profiles"
+    images = tmp_path / "images"
+    for paper in ["paperA", "paperB"]:
+        (profiles / paper).mkdir(parents=True)
+        (images / paper).mkdir(parents=True)
+        for page in range(2):
+            Image.new("RGB", (612, 792), "white").save(images / paper / f"page_{page:04d}.png")
+        recs = [
+            {"paper_id": paper, "boxes": [{"page": 0, "bbox_pdf": [72, 700, 300, 680], "cls": "display"},
+                                          {"page": 1, "bbox_pdf": [100, 500, 200, 480], "cls": "inline"}]},
+            # degenerate box -> skipped
+            {"paper_id": paper, "boxes": [{"page": 1, "bbox_pdf": [50, 50, 50, 50]}]},
+        ]
+        (profiles / paper / "equations.jsonl").write_text("\n".join(json.dumps(r) for r in recs), encoding="utf-8")
+    return profiles, images
+
+def test_convert_profiles_to_coco_parallel_matches_serial(tmp_path):
+    profiles, images = make_profiles(tmp_path)
+    outs = []
+    for workers in [1, 2]:
+        out = tmp_path / f"instances_{workers}.json"
+        convert_profiles_to_coco(profiles, out, page_images_dir=images, workers=workers)
+        outs.append(json.loads(out.read_text(encoding="utf-8")))
+    serial, parallel = outs
+    assert serial["images"] == parallel["images"]
+    assert serial["annotations"] == parallel["annotations"]
+    assert len(serial["images"]) == 4
+    assert [a["id"] for a in serial["annotations"]] == [1, 2, 3, 4]
+    assert [a["category_id"] for a in serial["annotations"]] == [1, 2, 1, 2]
+    # fallback conversion on a 612pt-wide page is 1 px per point with Y flipped
+    assert serial["annotations"][0]["bbox"] == [72.0, 92.0, 228.0, 20.0]
+
+def test_missing_page_image_gets_placeholder_record(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    profiles = tmp_path / "profiles" / "paperC"
+    profiles.mkdir(parents=True)
+    rec = {"paper_id": "paperC", "boxes": [{"page": 3, "bbox_pdf": [100, 200, 1500, 260], "cls": "display"}]}
+    (profiles / "equations.jsonl").write_text(json.dumps(rec), encoding="utf-8")
+    out = tmp_path / "instances.json"
+    convert_profiles_to_coco(tmp_path / "profiles", out, workers=1)
+    coco = json.loads(out.read_text(encoding="utf-8"))
+    assert coco["images"] == [{"id": 1, "file_name": "__synthetic__/paperC_page_0003.png", "width": 1510, "height": 1024}]
+    assert len(coco["annotations"]) == 1
+    # no placeholder PNG is written
+    assert not (tmp_path / "detector").exists()
@@ -0,0 +1,55 @@
+import json
+from pathlib import Path
+from PIL import Image, ImageDraw
+import pytest
+from detector.make_pairs import coco_to_pairs, find_latex_for_annotation
+
+def make_sample(tmpdir):
+    tmpdir = Path(tmpdir)
+    img_path = tmpdir / "page_0000.png"
+    img = Image.new("RGB", (400, 300), "white")
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([50, 40, 150, 80], outline="black", width=2)
+    draw.rectangle([200, 150, 350, 200], outline="black", width=2)
+    img.save(img_path)
+    meta = {"file_name": str(img_path), "width": 400, "height": 300, "eqs": [
+        {"latex": "E = mc^2", "bbox": [50, 40, 150, 80], "type": "display"},
+        {"latex": "a^2 + b^2 = c^2", "bbox": [200, 150, 350, 200], "type": "display"},
+    ]}
+    img_path.with_suffix(".meta.json").write_text(json.dumps(meta), encoding="utf-8")
+    images = [{"id": 1, "file_name": str(img_path), "width": 400, "height": 300}]
+    annotations = [
+        {"id": 1, "image_id": 1, "category_id": 1, "bbox": [50, 40, 100, 40]},
+        {"id": 2, "image_id": 1, "category_id": 1, "bbox": [200, 150, 150, 50]},
+        # no matching equation in the meta file -> skipped
+        {"id": 3, "image_id": 1, "category_id": 1, "bbox": [0, 250, 30, 30]},
+    ]
+    coco = {"images": images, "annotations": annotations, "categories": [{"id": 1, "name": "display"}]}
+    coco_path = tmpdir / "instances.json"
+    json.dump(coco, open(coco_path, "w"))
+    return coco_path
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_coco_to_pairs(tmp_path, workers):
+    coco = make_sample(tmp_path)
+    out_jsonl = tmp_path / "pairs.jsonl"
+    coco_to_pairs(coco, tmp_path / "crops", out_jsonl, workers=workers)
+    pairs = [json.loads(line) for line in out_jsonl.read_text(encoding="utf-8").splitlines()]
+    assert [p["latex"] for p in pairs] == ["E = mc^2", "a^2 + b^2 = c^2"]
+    for p in pairs:
+        assert Path(p["image"]).exists()
+
+def test_find_latex_for_annotation():
+    meta = {"eqs": [
+        {"latex": "b", "bbox": [0, 100, 100, 140]},
+        {"latex": "a", "bbox": [0, 0, 100, 40]},
+        # same box as "a" but later in the file: ties keep the first record
+        {"latex": "a2", "bbox": [0, 0, 100, 40]},
+    ]}
+    assert find_latex_for_annotation(meta, [0, 0, 100, 40]) == "a"
+    assert find_latex_for_annotation(meta, [10, 105, 80, 30]) == "b"
+    # overlap below 25% of the annotation area
+    assert find_latex_for_annotation(meta, [90, 30, 100, 100]) is None
+    # empty annotation / empty meta
+    assert find_latex_for_annotation(meta, [0, 0, 0, 40]) is None
+    assert find_latex_for_annotation({"eqs": []}, [0, 0, 100, 40]) is None
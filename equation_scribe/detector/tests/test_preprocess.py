@@ -19,3 +19,20 @@ def test_preprocess(tmp_path):
     # result should be 2D array (grayscale)
     assert out.ndim == 2
     assert out.shape[0] == h and out.shape[1] == w
+
+def test_process_folder_parallel_matches_serial(tmp_path):
+    import cv2
+    from detector.preprocess import process_folder
+    in_dir = tmp_path / "in"
+    in_dir.mkdir()
+    for i in range(3):
+        arr = np.zeros((200, 300, 3), dtype=np.uint8) + 255
+        cv2.putText(arr, f"x_{i}", (20, 100), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 0, 0), 2)
+        Image.fromarray(arr).save(in_dir / f"page_{i:04d}.png")
+    process_folder(in_dir, tmp_path / "serial", workers=1, denoise=False, clahe=True, binarize=True)
+    process_folder(in_dir, tmp_path / "parallel", workers=2, denoise=False, clahe=True, binarize=True)
+    for i in range(3):
+        name = f"page_{i:04d}.png"
+        a = np.array(Image.open(tmp_path / "serial" / name))
+        b = np.array(Image.open(tmp_path / "parallel" / name))
+        assert np.array_equal(a, b)
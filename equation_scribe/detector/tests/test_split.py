@@ -31,3 +31,7 @@ def test_split(tmp_path):
     train_ids = set(img['id'] for img in train['images'])
     val_ids = set(img['id'] for img in val['images'])
     assert train_ids.intersection(val_ids) == set()
+    # every annotation lands in the split that holds its image
+    assert all(a['image_id'] in train_ids for a in train['annotations'])
+    assert all(a['image_id'] in val_ids for a in val['annotations'])
+    assert len(train['annotations']) + len(val['annotations']) == 2
@@ -0,0 +1,60 @@
+from detector.synctex_extractor import find_display_regions, _parse_synctex_output
+
+TEX = r"""\documentclass{article}
+\begin{document}
+Some text.
+\begin{equation}
+E = mc^2
+\end{equation}
+More text.
+\[
+a^2 + b^2 = c^2
+\]
+$$
+x + y
+$$
+\begin{align*}
+f(x) &= x^2
+\end{align*}
+\end{document}
+"""
+
+def test_find_display_regions(tmp_path):
+    tex = tmp_path / "main.tex"
+    tex.write_text(TEX, encoding="utf-8")
+    regions = find_display_regions(tex)
+    assert [(s, e) for s, e, _ in regions] == [(4, 6), (8, 10), (11, 13), (14, 16)]
+    assert "E = mc^2" in regions[0][2]
+    assert "f(x)" in regions[3][2]
+
+def test_parse_synctex_output():
+    out = ("This is SyncTeX command line utility, version 1.5\n"
+           "SyncTeX result begin\nOutput:/tmp/y1/main.pdf\nPage:2\n"
+           "x:133.768356\ny:140.181564\nh:133.768356\nv:143.169464\n"
+           "SyncTeX result end\n")
+    assert _parse_synctex_output(out) == (2, 133.768356, 140.181564)
+    assert _parse_synctex_output("Output:Page: 5; x: 12.5; y: 7") == (5, 12.5, 7.0)
+    assert _parse_synctex_output("no result") == (None, None, None)
+
+def test_extract_synctex_pairs_keeps_region_order(tmp_path, monkeypatch):
+    import json
+    import os
+    import stat
+    from detector import synctex_extractor
+    # fake synctex binary: echo the queried line back as the page number
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    fake = bin_dir / "synctex"
+    fake.write_text('#!/bin/sh\nline=${3%%:*}\nsleep 0.0$((line % 3))\necho "Page:$line"\necho "x:1.5"\necho "y:2.5"\n')
+    fake.chmod(fake.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setattr(synctex_extractor, "compile_with_synctex",
+                        lambda tex, work: (work / "main.pdf").write_bytes(b"%PDF"))
+    tex = tmp_path / "main.tex"
+    tex.write_text(TEX, encoding="utf-8")
+    out = tmp_path / "pairs.jsonl"
+    synctex_extractor.extract_synctex_pairs(tex, out, workers=4)
+    recs = [json.loads(line) for line in out.read_text(encoding="utf-8").splitlines()]
+    assert [r["start_line"] for r in recs] == [4, 8, 11, 14]
+    assert [r["page"] for r in recs] == [3, 7, 10, 13]
+    assert recs[0]["synctex_x"] == 1.5 and recs[0]["synctex_y"] == 2.5
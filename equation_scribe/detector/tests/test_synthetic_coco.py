@@ -0,0 +1,22 @@
+import json
+import numpy as np
+from PIL import Image
+from detector.synthetic_coco import make_synthetic_dataset
+
+def test_parallel_dataset_matches_serial(tmp_path):
+    outs = {}
+    for workers in (1, 2):
+        img_dir = tmp_path / f"w{workers}"
+        ann = img_dir / "instances_all.json"
+        make_synthetic_dataset(img_dir, ann, n_pages=3, eqs_per_page=2, dpi=100, workers=workers)
+        coco = json.loads(ann.read_text())
+        for im in coco["images"]:
+            im["file_name"] = im["file_name"].split("/")[-1]
+        outs[workers] = (img_dir, coco)
+    (dir_a, coco_a), (dir_b, coco_b) = outs[1], outs[2]
+    assert coco_a == coco_b
+    assert len(coco_a["images"]) == 3
+    for im in coco_a["images"]:
+        a = np.array(Image.open(dir_a / im["file_name"]))
+        b = np.array(Image.open(dir_b / im["file_name"]))
+        assert np.array_equal(a, b)
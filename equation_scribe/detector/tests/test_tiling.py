@@ -2,7 +2,10 @@ import tempfile
 from pathlib import Path
 from PIL import Image, ImageDraw
 import json
-from detector.tiling import generate_tiles_from_coco
+import random
+import tarfile
+import numpy as np
+from detector.tiling import generate_tiles_from_coco, crop_and_collect_tiles
 
 def make_sample_image(img_path):
     img = Image.new("RGB", (800, 1200), "white")
@@ -33,3 +36,103 @@ def test_tiling(tmp_path):
     # ensure at least one tile was produced
     assert len(data["images"]) > 0
 
+
+def test_crop_and_collect_tiles_clips_boxes():
+    img = Image.new("RGB", (800, 600), "white")
+    anns = [{"bbox": [400, 100, 200, 50], "category_id": 1},
+            {"bbox": [10, 10, 0, 20], "category_id": 2}]
+    tiles = crop_and_collect_tiles(img, anns, tile_size=512, stride=256,
+                                   min_area_frac=0.5, keep_empty_prob=0.0)
+    boxes = {tuple(t["tile_box"]): t["annos"] for t in tiles}
+    # fully inside the right-hand tile, 56% inside the left one
+    assert boxes[(288, 0, 800, 512)] == [{"bbox": [112, 100, 200, 50], "category_id": 1}]
+    assert boxes[(0, 0, 512, 512)] == [{"bbox": [400, 100, 112, 50], "category_id": 1}]
+    # the zero-area annotation is never kept and no empty tiles survive
+    assert all(t["annos"] for t in tiles)
+
+def test_tiling_npz_format(tmp_path):
+    img_dir = tmp_path / "images"
+    img_dir.mkdir()
+    img_path = img_dir / "paperA_page_0001.png"
+    make_sample_image(img_path)
+    coco = make_sample_coco(tmp_path, img_path)
+    out = generate_tiles_from_coco(coco, img_dir, tmp_path / "tiles", tmp_path / "tiles.json",
+                                   tile_size=512, stride=256, min_area_frac=0.1, tile_format="npz")
+    data = json.load(open(out))
+    first = data["images"][0]
+    assert first["file_name"].endswith(".npz")
+    arr = np.load(first["file_name"])["img"]
+    assert arr.shape[:2] == (first["height"], first["width"])
+
+def test_parallel_tiling_matches_serial(tmp_path):
+    img_dir = tmp_path / "images"
+    img_dir.mkdir()
+    images = []
+    for i in (1, 2):
+        img_path = img_dir / f"paperA_page_{i:04d}.png"
+        make_sample_image(img_path)
+        images.append({"id": i, "file_name": str(img_path), "width": 800, "height": 1200})
+    annotations = [{"id": 1, "image_id": 2, "category_id": 1, "bbox": [100, 200, 100, 100]}]
+    coco = tmp_path / "instances.json"
+    json.dump({"images": images, "annotations": annotations, "categories": []}, open(coco, "w"))
+    outs = {}
+    for workers in (1, 2):
+        random.seed(0)
+        out = generate_tiles_from_coco(coco, img_dir, tmp_path / f"w{workers}", tmp_path / f"w{workers}.json",
+                                       tile_size=512, stride=256, keep_empty_prob=0.5, workers=workers)
+        data = json.load(open(out))
+        for im in data["images"]:
+            im["file_name"] = Path(im["file_name"]).name
+        outs[workers] = data
+    assert outs[1] == outs[2]
+    assert len(outs[1]["annotations"]) > 0
+
+def test_tiling_tar_shards(tmp_path):
+    img_dir = tmp_path / "images"
+    img_dir.mkdir()
+    img_path = img_dir / "paperA_page_0001.png"
+    make_sample_image(img_path)
+    coco = make_sample_coco(tmp_path, img_path)
+    out = generate_tiles_from_coco(coco, img_dir, tmp_path / "tiles", tmp_path / "tiles.json",
+                                   tile_size=512, stride=256, min_area_frac=0.1, shard_size=2)
+    data = json.load(open(out))
+    for im in data["images"]:
+        shard_path, member = im["file_name"].split("::")
+        with tarfile.open(shard_path) as tar:
+            tile = Image.open(tar.extractfile(member))
+            assert tile.size == (im["width"], im["height"])
+    shards = sorted(p.name for p in (tmp_path / "tiles").iterdir())
+    assert shards[0] == "shard-00000.tar"
+    assert len(shards) == (len(data["images"]) + 1) // 2
+
+def test_tiling_dedup_links_identical_tiles(tmp_path):
+    img_dir = tmp_path / "images"
+    img_dir.mkdir()
+    img_path = img_dir / "paperA_page_0001.png"
+    make_sample_image(img_path)
+    coco = make_sample_coco(tmp_path, img_path)
+    out = generate_tiles_from_coco(coco, img_dir, tmp_path / "tiles", tmp_path / "tiles.json",
+                                   tile_size=256, stride=256, keep_empty_prob=1.0, dedup=True)
+    data = json.load(open(out))
+    files = [Path(im["file_name"]) for im in data["images"]]
+    assert all(f.exists() for f in files)
+    # the blank tiles are hard links to one written file
+    assert len({f.stat().st_ino for f in files}) < len(files)
+    assert any(f.stat().st_nlink > 1 for f in files)
+    assert len({f.stat().st_ino for f in files}) == len({f.read_bytes() for f in files})
+
+def test_tiling_rerun_after_dedup_does_not_touch_linked_tiles(tmp_path):
+    img_dir = tmp_path / "images"
+    img_dir.mkdir()
+    img_path = img_dir / "paperA_page_0001.png"
+    make_sample_image(img_path)
+    coco = make_sample_coco(tmp_path, img_path)
+    kw = dict(tile_size=256, stride=128, keep_empty_prob=1.0)
+    fresh = generate_tiles_from_coco(coco, img_dir, tmp_path / "fresh", tmp_path / "fresh.json", **kw)
+    # a dedup run leaves hard-linked tiles behind; a later run into the same
+    # directory must replace them rather than write through the shared inode
+    generate_tiles_from_coco(coco, img_dir, tmp_path / "tiles", tmp_path / "first.json",
+                             tile_size=256, stride=256, keep_empty_prob=1.0, dedup=True)
+    rerun = generate_tiles_from_coco(coco, img_dir, tmp_path / "tiles", tmp_path / "rerun.json", **kw)
+    for a, b in zip(json.load(open(fresh))["images"], json.load(open(rerun))["images"]):
+        assert Path(a["file_name"]).read_bytes() == Path(b["file_name"]).read_bytes()
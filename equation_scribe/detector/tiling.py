@@ -8,22 +8,40 @@ Usage:
      --tile-size 1024 --stride 512 --min-area-frac 0.25
 """
 
+import os
+import io
 import json
+import tarfile
+import shutil
+import hashlib
+import tempfile
 import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache, partial
 from pathlib import Path
 from typing import List, Dict
 from PIL import Image
+import numpy as np
 import random
 import math
 from tqdm import tqdm
 
-def crop_and_collect_tiles(img_path: Path, anns_for_image: List[Dict],
-                           tile_size: int = 1024, stride: int = 512,
-                           min_area_frac: float = 0.25, keep_empty_prob: float = 0.05):
-    im = Image.open(img_path)
-    W, H = im.size
-    tiles = []
-    y = 0
+# Optional fast JSON encoder
+try:
+    import orjson
+    HAVE_ORJSON = True
+except Exception:
+    HAVE_ORJSON = False
+
+def _dumps(obj) -> bytes:
+    """Compact UTF-8 JSON bytes (orjson when available)."""
+    if HAVE_ORJSON:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+@lru_cache(maxsize=32)
+def _tile_positions(W: int, H: int, tile_size: int, stride: int):
+    # pages mostly share a handful of sizes, so the tile grid is memoized
     x_positions = list(range(0, max(1, W - tile_size + 1), stride))
     y_positions = list(range(0, max(1, H - tile_size + 1), stride))
     # ensure last tile touches edge
@@ -31,40 +49,52 @@ def crop_and_collect_tiles(img_path: Path, anns_for_image: List[Dict],
         x_positions.append(max(0, W - tile_size))
     if not y_positions or y_positions[-1] + tile_size < H:
         y_positions.append(max(0, H - tile_size))
+    return tuple(x_positions), tuple(y_positions)
+
+def crop_and_collect_tiles(img_path, anns_for_image: List[Dict],
+                           tile_size: int = 1024, stride: int = 512,
+                           min_area_frac: float = 0.25, keep_empty_prob: float = 0.05,
+                           rng: random.Random = None):
+    # rng (default: the global random module) decides which empty tiles to keep.
+    # img_path may also be an already opened PIL image, so callers that crop
+    # the tiles afterwards don't have to open the file twice
+    if isinstance(img_path, Image.Image):
+        W, H = img_path.size
+    else:
+        with Image.open(img_path) as im:
+            W, H = im.size
+    tiles = []
+    x_positions, y_positions = _tile_positions(W, H, tile_size, stride)
+
+    # annotation boxes as (x0, y0, x1, y1) columns, intersected with each
+    # tile in one vectorized step instead of a Python loop per annotation
+    boxes = np.asarray([a["bbox"] for a in anns_for_image]).reshape(-1, 4)
+    ax0, ay0 = boxes[:, 0], boxes[:, 1]
+    ax1, ay1 = ax0 + boxes[:, 2], ay0 + boxes[:, 3]
+    ann_area = boxes[:, 2] * boxes[:, 3]
+    cat_ids = [a["category_id"] for a in anns_for_image]
 
     tile_id = 0
     for y0 in y_positions:
         for x0 in x_positions:
             x1 = min(x0 + tile_size, W)
             y1 = min(y0 + tile_size, H)
+            inter_x0 = np.maximum(x0, ax0)
+            inter_y0 = np.maximum(y0, ay0)
+            inter_w = np.minimum(x1, ax1) - inter_x0
+            inter_h = np.minimum(y1, ay1) - inter_y0
+            keep = (inter_w > 0) & (inter_h > 0) & (ann_area > 0)
+            keep[keep] = (inter_w[keep] * inter_h[keep]) / ann_area[keep] >= min_area_frac
             kept = []
-            for ann in anns_for_image:
-                bx, by, bw, bh = ann["bbox"]
-                ax0, ay0, ax1, ay1 = bx, by, bx + bw, by + bh
-                inter_x0 = max(x0, ax0)
-                inter_y0 = max(y0, ay0)
-                inter_x1 = min(x1, ax1)
-                inter_y1 = min(y1, ay1)
-                if inter_x1 <= inter_x0 or inter_y1 <= inter_y0:
-                    continue
-                inter_area = (inter_x1 - inter_x0) * (inter_y1 - inter_y0)
-                ann_area = bw * bh
-                if ann_area <= 0:
-                    continue
-                if (inter_area / ann_area) >= min_area_frac:
-                    # compute adjusted bbox relative to tile top-left
-                    nx0 = inter_x0 - x0
-                    ny0 = inter_y0 - y0
-                    nx1 = inter_x1 - x0
-                    ny1 = inter_y1 - y0
-                    nw = nx1 - nx0
-                    nh = ny1 - ny0
-                    kept.append({
-                        "bbox": [nx0, ny0, nw, nh],
-                        "category_id": ann["category_id"]
-                    })
+            for i in np.flatnonzero(keep).tolist():
+                # adjusted bbox relative to tile top-left
+                kept.append({
+                    "bbox": [(inter_x0[i] - x0).item(), (inter_y0[i] - y0).item(),
+                             inter_w[i].item(), inter_h[i].item()],
+                    "category_id": cat_ids[i]
+                })
             # decide if we keep the tile
-            if kept or (random.random() < keep_empty_prob):
+            if kept or ((rng or random).random() < keep_empty_prob):
                 # save tile image path (no saving here, return info)
                 tiles.append({
                     "tile_index": tile_id,
@@ -74,9 +104,132 @@ def crop_and_collect_tiles(img_path: Path, anns_for_image: List[Dict],
                 tile_id += 1
     return tiles
 
+# on-disk tile formats; png is lossless, jpg/bmp/npz trade size for encode
+# speed (pillow-simd is a drop-in Pillow replacement with faster codecs)
+TILE_FORMATS = ("png", "jpg", "bmp", "npz")
+
+def _encode_tile(tile_img, tile_format: str = "png") -> bytes:
+    # tiles are intermediate training data: favour encode speed over file size.
+    # npz tiles arrive as array views of the page, image formats as PIL crops
+    buf = io.BytesIO()
+    if tile_format == "png":
+        tile_img.save(buf, format="PNG", compress_level=1)
+    elif tile_format == "jpg":
+        if tile_img.mode not in ("L", "RGB"):
+            tile_img = tile_img.convert("RGB")
+        tile_img.save(buf, format="JPEG", quality=92)
+    elif tile_format == "bmp":
+        tile_img.save(buf, format="BMP")
+    else:
+        np.savez_compressed(buf, img=np.asarray(tile_img))
+    return buf.getvalue()
+
+def _save_tile(tile_img, out_tile_path: Path, tile_format: str = "png"):
+    # write to a fresh inode: an earlier --dedup run may have hard-linked this
+    # path to other tiles, and writing through it would change them all
+    out_tile_path.unlink(missing_ok=True)
+    out_tile_path.write_bytes(_encode_tile(tile_img, tile_format))
+
+# tiles already written by this process in the current run, keyed by pixel
+# content, so identical tiles (blank margins, mostly) are hard-linked to the
+# first copy instead of being encoded again
+_SEEN_TILES = (None, {})
+
+def _seen_tiles(run_id: str) -> dict:
+    global _SEEN_TILES
+    if _SEEN_TILES[0] != run_id:
+        _SEEN_TILES = (run_id, {})
+    return _SEEN_TILES[1]
+
+def _tile_key(tile_img):
+    if isinstance(tile_img, np.ndarray):
+        meta = (tile_img.dtype.str, tile_img.shape)
+    else:
+        meta = (tile_img.mode, tile_img.size)
+    return meta, hashlib.blake2b(tile_img.tobytes(), digest_size=16).digest()
+
+def _link_tile(src: Path, dst: Path):
+    """Hard-link dst to an identical, already written tile (copy where links are unsupported)."""
+    if dst == src:
+        return
+    dst.unlink(missing_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+def _tile_one_image(job, out_images_dir: Path, tile_size: int, stride: int, min_area_frac: float,
+                    keep_empty_prob: float, tile_format: str, save_threads: int, shard: bool = False,
+                    dedup_run: str = None):
+    """Tile one page and save its tiles; top-level so ProcessPoolExecutor can pickle it.
+
+    Returns (tile_name, width, height, annos, data) per tile; ids are assigned by
+    the caller. With shard=True tiles are only encoded and data holds the bytes
+    for the caller to pack, otherwise they are written and data is None.
+    With dedup_run set, tiles identical to one written earlier in that run
+    are hard-linked to it rather than encoded.
+    """
+    candidate, anns_for_image, seed = job
+    records = []
+    seen = _seen_tiles(dedup_run) if dedup_run and not shard else None
+    links = []
+    # decode the page once and crop every tile from it
+    with Image.open(candidate) as src_im:
+        src_im.load()
+        # npz tiles are plain slices of one page array (views, no per-tile
+        # copy before encoding); PIL's C crop stays faster for image formats
+        page_arr = np.asarray(src_im) if tile_format == "npz" else None
+        tiles = crop_and_collect_tiles(src_im, anns_for_image, tile_size=tile_size, stride=stride,
+                                       min_area_frac=min_area_frac, keep_empty_prob=keep_empty_prob,
+                                       rng=random.Random(seed))
+        # tile encodes run on a thread pool; PIL releases the GIL while
+        # compressing, so writes overlap the next crops
+        with ThreadPoolExecutor(max_workers=save_threads) as ex:
+            saves = []
+            for t in tiles:
+                x0,y0,x1,y1 = t["tile_box"]
+                if page_arr is not None:
+                    tile_img = page_arr[y0:y1, x0:x1]
+                    w, h = x1 - x0, y1 - y0
+                else:
+                    tile_img = src_im.crop((x0,y0,x1,y1))
+                    w,h = tile_img.size
+                tile_name = f"{candidate.stem}_tile_{t['tile_index']:04d}.{tile_format}"
+                out_tile_path = out_images_dir / tile_name
+                key = _tile_key(tile_img) if seen is not None else None
+                if key is not None and key in seen:
+                    links.append((seen[key], out_tile_path))
+                    saves.append(None)
+                else:
+                    if key is not None:
+                        seen[key] = out_tile_path
+                    if shard:
+                        saves.append(ex.submit(_encode_tile, tile_img, tile_format))
+                    else:
+                        saves.append(ex.submit(_save_tile, tile_img, out_tile_path, tile_format))
+                records.append((tile_name, w, h, t["annos"]))
+            # collect encoded bytes (None when written) and surface any write error
+            records = [rec + (f.result() if f is not None else None,) for rec, f in zip(records, saves)]
+    # every link source has been written by now, on this page or an earlier one
+    for src, dst in links:
+        _link_tile(src, dst)
+    return records
+
+def _run_pages(worker, jobs, workers: int):
+    """Yield worker(job) for every job in order, in-process or on a process pool."""
+    if workers == 1:
+        for job in jobs:
+            yield worker(job)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            yield from ex.map(worker, jobs, chunksize=1)
+
 def generate_tiles_from_coco(coco_in_path: Path, images_root: Path, out_images_dir: Path,
                              out_annotations_path: Path, tile_size=1024, stride=512,
-                             min_area_frac=0.25, keep_empty_prob=0.05):
+                             min_area_frac=0.25, keep_empty_prob=0.05, save_threads=None,
+                             tile_format="png", workers=None, shard_size=0, dedup=False):
+    if tile_format not in TILE_FORMATS:
+        raise ValueError(f"unknown tile format: {tile_format}")
     coco = json.load(open(coco_in_path, "r", encoding="utf-8"))
     images = coco.get("images", [])
     anns = coco.get("annotations", [])
@@ -89,12 +242,9 @@ def generate_tiles_from_coco(coco_in_path: Path, images_root: Path, out_images_d
 
     out_images_dir = Path(out_images_dir)
     out_images_dir.mkdir(parents=True, exist_ok=True)
-    tile_images_info = []
-    tile_annotations = []
-    next_image_id = 1
-    next_ann_id = 1
 
-    for img in tqdm(images, desc="Tiling images"):
+    jobs = []
+    for img in images:
         img_file = Path(img["file_name"])
         # try to resolve relative path under images_root
         candidate = Path(img["file_name"])
@@ -108,45 +258,73 @@ def generate_tiles_from_coco(coco_in_path: Path, images_root: Path, out_images_d
         if not candidate.exists():
             print("Skipping missing image:", img["file_name"])
             continue
-        anns_for_image = ann_by_image.get(img["id"], [])
-        tiles = crop_and_collect_tiles(candidate, anns_for_image, tile_size=tile_size, stride=stride,
-                                       min_area_frac=min_area_frac, keep_empty_prob=keep_empty_prob)
-        # save tiles and build COCO
-        for t in tiles:
-            x0,y0,x1,y1 = t["tile_box"]
-            tile_img = Image.open(candidate).crop((x0,y0,x1,y1))
-            tile_name = f"{candidate.stem}_tile_{t['tile_index']:04d}.png"
-            out_tile_path = out_images_dir / tile_name
-            tile_img.save(out_tile_path)
-            # image record
-            w,h = tile_img.size
-            tile_images_info.append({"id": next_image_id, "file_name": str(out_tile_path), "width": w, "height": h})
-            # annotations for this tile
-            for ann in t["annos"]:
-                bbox = ann["bbox"]
-                cat_id = ann["category_id"]
-                tile_annotations.append({
-                    "id": next_ann_id,
-                    "image_id": next_image_id,
-                    "category_id": cat_id,
-                    "bbox": [float(bbox[0]), float(bbox[1]), float(bbox[2]), float(bbox[3])],
-                    "area": float(bbox[2] * bbox[3]),
-                    "iscrowd": 0,
-                    "segmentation": []
-                })
-                next_ann_id += 1
-            next_image_id += 1
-
-    coco_tiles = {
-        "info": {"description": "Tiled dataset"},
-        "licenses": [],
-        "images": tile_images_info,
-        "annotations": tile_annotations,
-        "categories": categories
-    }
+        # one seed per page, drawn here, so the kept empty tiles do not
+        # depend on how many workers tile the pages
+        jobs.append((candidate, ann_by_image.get(img["id"], []), random.getrandbits(32)))
+
+    # pages are tiled in worker processes (workers=None: all cores), each
+    # saving its tiles on save_threads threads (default: its share of cores)
+    workers = min(workers or os.cpu_count() or 1, max(len(jobs), 1))
+    save_threads = save_threads or max(1, (os.cpu_count() or 1) // workers)
+    worker = partial(_tile_one_image, out_images_dir=out_images_dir, tile_size=tile_size, stride=stride,
+                     min_area_frac=min_area_frac, keep_empty_prob=keep_empty_prob,
+                     tile_format=tile_format, save_threads=save_threads, shard=shard_size > 0,
+                     dedup_run=os.urandom(8).hex() if dedup else None)
+
+    # The COCO file is streamed one record per line: annotations are written as
+    # each page's tiles arrive and image records are spooled to a scratch file
+    # that follows them, so neither list is held in memory.
     out_annotations_path.parent.mkdir(parents=True, exist_ok=True)
-    json.dump(coco_tiles, open(out_annotations_path, "w", encoding="utf-8"), indent=2)
-    print(f"Wrote tiled COCO: {out_annotations_path} images={len(tile_images_info)} anns={len(tile_annotations)}")
+    with out_annotations_path.open("wb", buffering=1 << 20) as fh, \
+            tempfile.TemporaryFile(dir=out_annotations_path.parent) as images_fh:
+        fh.write(b'{"info":' + _dumps({"description": "Tiled dataset"}) + b',"licenses":[],"annotations":[')
+
+        # assign ids in page order, exactly as a serial run would. With shard_size
+        # set, tiles are packed into tar shards of shard_size tiles each and
+        # file_name becomes "<shard path>::<member name>".
+        next_image_id = 1
+        next_ann_id = 1
+        shard = None
+        for records in tqdm(_run_pages(worker, jobs, workers), total=len(jobs), desc="Tiling images"):
+            for tile_name, w, h, annos, data in records:
+                if shard_size > 0:
+                    if (next_image_id - 1) % shard_size == 0:
+                        if shard is not None:
+                            shard.close()
+                        shard_path = out_images_dir / f"shard-{(next_image_id - 1) // shard_size:05d}.tar"
+                        shard = tarfile.open(shard_path, "w")
+                    info = tarfile.TarInfo(tile_name)
+                    info.size = len(data)
+                    shard.addfile(info, io.BytesIO(data))
+                    file_name = f"{shard_path}::{tile_name}"
+                else:
+                    file_name = str(out_images_dir / tile_name)
+                img_record = {"id": next_image_id, "file_name": file_name, "width": w, "height": h}
+                images_fh.write((b",\n" if next_image_id > 1 else b"\n") + _dumps(img_record))
+                # annotations for this tile
+                for ann in annos:
+                    bbox = ann["bbox"]
+                    cat_id = ann["category_id"]
+                    tile_ann = {
+                        "id": next_ann_id,
+                        "image_id": next_image_id,
+                        "category_id": cat_id,
+                        "bbox": [float(bbox[0]), float(bbox[1]), float(bbox[2]), float(bbox[3])],
+                        "area": float(bbox[2] * bbox[3]),
+                        "iscrowd": 0,
+                        "segmentation": []
+                    }
+                    fh.write((b",\n" if next_ann_id > 1 else b"\n") + _dumps(tile_ann))
+                    next_ann_id += 1
+                next_image_id += 1
+        if shard is not None:
+            shard.close()
+
+        fh.write(b'\n],"images":[')
+        images_fh.seek(0)
+        shutil.copyfileobj(images_fh, fh)
+        fh.write(b'\n],"categories":' + _dumps(categories) + b"}\n")
+    print(f"Wrote tiled COCO: {out_annotations_path} images={next_image_id - 1} anns={next_ann_id - 1}")
     return out_annotations_path
 
 def main():
@@ -159,10 +337,19 @@ def main():
     p.add_argument("--stride", type=int, default=512)
     p.add_argument("--min-area-frac", type=float, default=0.25)
     p.add_argument("--keep-empty-prob", type=float, default=0.05)
+    p.add_argument("--tile-format", choices=TILE_FORMATS, default="png",
+                   help="Tile image format (png is lossless; jpg/bmp/npz encode faster)")
+    p.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    p.add_argument("--shard-size", type=int, default=0,
+                   help="Pack tiles into tar shards of this many tiles (default 0: one file per tile)")
+    p.add_argument("--dedup", action="store_true",
+                   help="Hard-link tiles identical to an already written one instead of encoding them again")
     args = p.parse_args()
     generate_tiles_from_coco(Path(args.coco), Path(args.images_root), Path(args.out_images),
                              Path(args.out_annotations), tile_size=args.tile_size, stride=args.stride,
-                             min_area_frac=args.min_area_frac, keep_empty_prob=args.keep_empty_prob)
+                             min_area_frac=args.min_area_frac, keep_empty_prob=args.keep_empty_prob,
+                             tile_format=args.tile_format, workers=args.workers,
+                             shard_size=args.shard_size, dedup=args.dedup)
 
 if __name__ == "__main__":
     main()
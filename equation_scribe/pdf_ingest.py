@@ -1,9 +1,14 @@
 
 from __future__ import annotations
-from dataclasses import dataclass
+import os
+from concurrent.futures import ProcessPoolExecutor
+import threading
+from dataclasses import dataclass, field
+from functools import lru_cache, partial
 from pathlib import Path
-from typing import List, Tuple, Dict, Any, Optional
+from typing import List, Tuple, Dict, Any, Iterable, Optional
 import re
+import numpy as np
 import fitz  # PyMuPDF
 import pdfplumber
 from PIL import Image
@@ -17,6 +22,15 @@ except Exception:
 
 PT_PER_INCH = 72.0  # PDF coordinate system: 72 points per inch
 
+# Tesseract options for page_layout_ocr: LSTM engine only, and no inverted-text
+# retry pass (pages are dark text on light paper). For a further speedup install
+# the "fast" models (eng.traineddata from tesseract-ocr/tessdata_fast).
+TESSERACT_CONFIG = "--oem 1 -c tessedit_do_invert=0"
+
+# Highest DPI pages are rendered at for OCR: tesseract's cost grows with pixel
+# count and accuracy stops improving well before the usual 300 DPI raster.
+OCR_DPI = 200
+
 
 @dataclass
 class PdfDoc:
@@ -27,16 +41,64 @@ class PdfDoc:
         path (Path): Filesystem path to the PDF.
         num_pages (int): Number of pages in the PDF.
         dpi (int): Default DPI for rasterization.
+
+    The PyMuPDF and pdfplumber documents are opened lazily and reused by
+    page_image / page_layout instead of reparsing the PDF on every call.
+    They are not pickled: a copy sent to a worker process reopens by path.
+    Use close() (or `with load_pdf(...) as doc:`) to release them.
     """
     path: Path
     num_pages: int
     dpi: int = 300
+    _fitz_doc: Any = field(default=None, init=False, repr=False, compare=False)
+    _plumber_doc: Any = field(default=None, init=False, repr=False, compare=False)
+    _lock: Any = field(default_factory=threading.RLock, init=False, repr=False, compare=False)
 
     @property
     def n_pages(self) -> int:
         """Compatibility alias expected by tests (doc.n_pages)."""
         return self.num_pages
 
+    def fitz(self) -> "fitz.Document":
+        """The cached PyMuPDF document (opened on first use)."""
+        with self._lock:
+            if self._fitz_doc is None:
+                self._fitz_doc = fitz.open(str(self.path))
+            return self._fitz_doc
+
+    def plumber(self) -> "pdfplumber.PDF":
+        """The cached pdfplumber document (opened on first use)."""
+        with self._lock:
+            if self._plumber_doc is None:
+                self._plumber_doc = pdfplumber.open(str(self.path))
+            return self._plumber_doc
+
+    def close(self) -> None:
+        """Close any cached document handles; they reopen on next use."""
+        with self._lock:
+            if self._fitz_doc is not None:
+                self._fitz_doc.close()
+                self._fitz_doc = None
+            if self._plumber_doc is not None:
+                self._plumber_doc.close()
+                self._plumber_doc = None
+
+    def __enter__(self) -> "PdfDoc":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(_fitz_doc=None, _plumber_doc=None)
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
 
 
 def load_pdf(path: str | Path, dpi: int = 300) -> PdfDoc:
@@ -67,10 +129,18 @@ def page_size_points(doc: PdfDoc, i: int) -> Tuple[float, float]:
     """
     if not (0 <= i < doc.num_pages):
         raise IndexError("page index out of range")
-    with fitz.open(str(doc.path)) as pdf:
-        page = pdf[i]
-        rect = page.rect
-        return float(rect.width), float(rect.height)
+    return _page_sizes(str(doc.path), Path(doc.path).stat().st_mtime_ns)[i]
+
+
+@lru_cache(maxsize=32)
+def _page_sizes(path: str, mtime_ns: int) -> Tuple[Tuple[float, float], ...]:
+    """
+    (width, height) in points of every page, read with a single fitz.open.
+    Cached per file version (mtime_ns is part of the key), so per-box callers
+    of page_size_points/pdf_to_px_transform don't reopen the PDF each time.
+    """
+    with fitz.open(path) as pdf:
+        return tuple((float(page.rect.width), float(page.rect.height)) for page in pdf)
 
 
 def page_image(doc: PdfDoc, i: int, dpi: Optional[int] = None) -> Image.Image:
@@ -87,12 +157,54 @@ def page_image(doc: PdfDoc, i: int, dpi: Optional[int] = None) -> Image.Image:
         raise IndexError("page index out of range")
     dpi = dpi or doc.dpi
     scale = dpi / PT_PER_INCH
-    with fitz.open(str(doc.path)) as pdf:
-        page = pdf[i]
+    with doc._lock:
+        page = doc.fitz()[i]
         mat = fitz.Matrix(scale, scale)
         pix = page.get_pixmap(matrix=mat, alpha=False)  # RGB
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-        return img
+    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    return img
+
+
+def _render_pages(path: str, indices: Tuple[int, ...], dpi: int) -> List[Tuple[int, int, bytes]]:
+    """
+    Render a run of pages with a single fitz.open; returns (width, height, RGB bytes)
+    per page. Top-level so ProcessPoolExecutor can pickle it.
+    """
+    scale = dpi / PT_PER_INCH
+    mat = fitz.Matrix(scale, scale)
+    out = []
+    with fitz.open(path) as pdf:
+        for i in indices:
+            pix = pdf[i].get_pixmap(matrix=mat, alpha=False)  # RGB
+            out.append((pix.width, pix.height, pix.samples))
+    return out
+
+
+def page_images(doc: PdfDoc, indices: Optional[Iterable[int]] = None, dpi: Optional[int] = None,
+                workers: Optional[int] = None) -> List[Image.Image]:
+    """
+    Rasterize several pages (default: all) to RGB Pillow Images, in order.
+
+    Pages are rendered in worker processes (workers=None uses all cores, 1 renders
+    in-process). PdfDoc is only a path, so each task reopens the PDF itself and
+    renders a contiguous run of pages to amortize the open.
+    """
+    indices = list(range(doc.num_pages)) if indices is None else list(indices)
+    for i in indices:
+        if not (0 <= i < doc.num_pages):
+            raise IndexError("page index out of range")
+    dpi = dpi or doc.dpi
+    workers = min(workers or os.cpu_count() or 1, max(len(indices), 1))
+    # a few tasks per worker keeps the pool balanced when page costs differ
+    size = max(1, len(indices) // (workers * 4))
+    chunks = [tuple(indices[k:k + size]) for k in range(0, len(indices), size)]
+    worker = partial(_render_pages, str(doc.path), dpi=dpi)
+    if workers == 1:
+        results = map(worker, chunks)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            results = list(ex.map(worker, chunks))
+    return [Image.frombytes("RGB", (w, h), samples) for chunk in results for w, h, samples in chunk]
 
 
 def pdf_to_px_transform(arg1, arg2=None, dpi: Optional[int] = None):
@@ -149,6 +261,42 @@ def pdf_to_px_transform(arg1, arg2=None, dpi: Optional[int] = None):
     return pdf_to_px, px_to_pdf
 
 
+def pdf_px_affine(doc: PdfDoc, page_index: int, dpi: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Array form of pdf_to_px_transform(doc, page_index, dpi) for batch conversions.
+
+    Returns (origin, scale), each shape (2,), such that for (..., 2) arrays of
+    (x, y) points:
+        px = (pt - origin) * scale      # PDF points -> pixels (Y flipped)
+        pt = px / scale + origin        # pixels -> PDF points
+    This evaluates the same float expressions as the pdf_to_px / px_to_pdf closures.
+    """
+    dpi = dpi or getattr(doc, "dpi", 300)
+    _, h_pt = page_size_points(doc, page_index)
+    s = dpi / PT_PER_INCH
+    return np.array([0.0, h_pt]), np.array([s, -s])
+
+
+def pdf_bboxes_to_px(doc: PdfDoc, page_index: int, bboxes_pdf, dpi: Optional[int] = None) -> np.ndarray:
+    """
+    Map an (N,4) array of PDF-point boxes (x0, y0, x1, y1) on one page to pixel
+    coordinates in one vectorized step. Each corner is converted exactly like
+    pdf_to_px (rounded to whole pixels, Y flipped, corners not re-ordered).
+    """
+    origin, scale = pdf_px_affine(doc, page_index, dpi=dpi)
+    pts = np.asarray(bboxes_pdf, dtype=np.float64).reshape(-1, 2, 2)
+    return np.rint((pts - origin) * scale).reshape(-1, 4)
+
+
+def px_bboxes_to_pdf(doc: PdfDoc, page_index: int, bboxes_px, dpi: Optional[int] = None) -> np.ndarray:
+    """
+    Inverse of pdf_bboxes_to_px: map an (N,4) array of pixel boxes on one page to
+    PDF points in one vectorized step (same values as px_to_pdf per corner).
+    """
+    origin, scale = pdf_px_affine(doc, page_index, dpi=dpi)
+    pts = np.asarray(bboxes_px, dtype=np.float64).reshape(-1, 2, 2)
+    return (pts / scale + origin).reshape(-1, 4)
+
 
 def page_layout(doc: PdfDoc, i: int) -> List[Dict[str, Any]]:
     """
@@ -162,30 +310,34 @@ def page_layout(doc: PdfDoc, i: int) -> List[Dict[str, Any]]:
     if not (0 <= i < doc.num_pages):
         raise IndexError("page index out of range")
     spans: List[Dict[str, Any]] = []
-    with pdfplumber.open(str(doc.path)) as pdf:
-        page = pdf.pages[i]
+    with doc._lock:
+        page = doc.plumber().pages[i]
         try:
             words = page.extract_words()
         except Exception:
             words = []
-        for w in words:
-            bbox_pdf = (float(w["x0"]), float(w["top"]), float(w["x1"]), float(w["bottom"]))
-            spans.append({
-                "text": w.get("text", ""),
-                "bbox_pdf": bbox_pdf,
-                "bbox": bbox_pdf,             # compatibility for tests that expect "bbox"
-                "page_index": i,
-            })
+        finally:
+            # drop the page's parsed objects; the document stays open
+            page.close()
+    for w in words:
+        bbox_pdf = (float(w["x0"]), float(w["top"]), float(w["x1"]), float(w["bottom"]))
+        spans.append({
+            "text": w.get("text", ""),
+            "bbox_pdf": bbox_pdf,
+            "bbox": bbox_pdf,             # compatibility for tests that expect "bbox"
+            "page_index": i,
+        })
     return spans
 
-def page_layout_ocr(doc: PdfDoc, i: int) -> List[Dict[str, Any]]:
+def page_layout_ocr(doc: PdfDoc, i: int, ocr_dpi: Optional[int] = None) -> List[Dict[str, Any]]:
     """
     OCR-based fallback for scanned / image-only PDFs.
 
     Strategy:
-      * Render the page to an RGB image.
+      * Render the page to a grayscale image at ocr_dpi
+        (default: doc.dpi capped at OCR_DPI).
       * Run Tesseract to get word boxes in pixel coordinates.
-      * Convert those into PDF point coordinates using px_to_pdf.
+      * Convert those into PDF point coordinates in one array op (px_bboxes_to_pdf).
       * Return spans in the same format as page_layout().
 
     Returns:
@@ -201,59 +353,83 @@ def page_layout_ocr(doc: PdfDoc, i: int) -> List[Dict[str, Any]]:
     if not (0 <= i < doc.num_pages):
         raise IndexError("page index out of range")
 
-    # Render image at the document DPI
-    img = page_image(doc, i, dpi=doc.dpi)
+    # Render at the OCR resolution; tesseract works on grayscale, so hand it a
+    # single channel rather than three
+    ocr_dpi = ocr_dpi or min(doc.dpi, OCR_DPI)
+    img = page_image(doc, i, dpi=ocr_dpi).convert("L")
 
-    # Coordinate transforms between PDF points and pixels
-    pdf_to_px, px_to_pdf = pdf_to_px_transform(doc, i, dpi=doc.dpi)
+    data = pytesseract.image_to_data(img, output_type=Output.DICT, config=TESSERACT_CONFIG)
+    texts = [(t or "").strip() for t in data.get("text", [])]
+    confs = data.get("conf", [])
 
-    data = pytesseract.image_to_data(img, output_type=Output.DICT)
-    n = len(data.get("text", []))
-    spans: List[Dict[str, Any]] = []
+    # Keep non-empty words whose confidence clears the bar (filters out garbage OCR)
+    keep = [idx for idx, txt in enumerate(texts)
+            if txt and _ocr_conf(confs, idx) >= 40]  # heuristic threshold; you can tune this
+    if not keep:
+        return []
 
-    for idx in range(n):
-        txt = (data["text"][idx] or "").strip()
-        if not txt:
-            continue
+    # Tesseract gives pixel coords in the image's coordinate system:
+    # left, top, width, height; origin is top-left of the image.
+    left = np.array([int(data["left"][idx]) for idx in keep])
+    top = np.array([int(data["top"][idx]) for idx in keep])
+    width = np.array([int(data["width"][idx]) for idx in keep])
+    height = np.array([int(data["height"][idx]) for idx in keep])
+    boxes_px = np.column_stack([left, top, left + width, top + height])
 
-        # Confidence: filter out garbage OCR
-        try:
-            conf = float(data.get("conf", ["0"])[idx])
-        except Exception:
-            conf = 0.0
-        if conf < 40:  # heuristic threshold; you can tune this
-            continue
-
-        # Tesseract gives pixel coords in the image's coordinate system:
-        # left, top, width, height; origin is top-left of the image.
-        x = int(data["left"][idx])
-        y = int(data["top"][idx])
-        w = int(data["width"][idx])
-        h = int(data["height"][idx])
-
-        x0_px, y0_px = x, y
-        x1_px, y1_px = x + w, y + h
-
-        # Map pixel coordinates back to PDF points
-        x0_pt, y0_pt = px_to_pdf(x0_px, y0_px)
-        x1_pt, y1_pt = px_to_pdf(x1_px, y1_px)
-
-        # Normalize so that x0 < x1 and y0 < y1
-        x0_pdf = float(min(x0_pt, x1_pt))
-        x1_pdf = float(max(x0_pt, x1_pt))
-        y0_pdf = float(min(y0_pt, y1_pt))
-        y1_pdf = float(max(y0_pt, y1_pt))
+    # Map every pixel box back to PDF points at once (same values as px_to_pdf per
+    # corner), then normalize so that x0 < x1 and y0 < y1
+    pts = px_bboxes_to_pdf(doc, i, boxes_px, dpi=ocr_dpi).reshape(-1, 2, 2)
+    boxes_pdf = np.concatenate([pts.min(axis=1), pts.max(axis=1)], axis=1)
 
+    spans: List[Dict[str, Any]] = []
+    for idx, (x0_pdf, y0_pdf, x1_pdf, y1_pdf) in zip(keep, boxes_pdf.tolist()):
+        bbox_pdf = (x0_pdf, y0_pdf, x1_pdf, y1_pdf)
         spans.append({
-            "text": w.get("text", ""),
+            "text": texts[idx],
             "bbox_pdf": bbox_pdf,
             "bbox": bbox_pdf,             # compatibility for tests that expect "bbox"
             "page_index": i,
-         })
+        })
 
     return spans
 
 
+def _ocr_conf(confs, idx: int) -> float:
+    """Tesseract confidence of word idx as a float (0.0 when missing or unparsable)."""
+    try:
+        return float(confs[idx])
+    except Exception:
+        return 0.0
+
+
+def _single_threaded_ocr() -> None:
+    """
+    Process-pool initializer: cap each worker's tesseract at one OpenMP thread.
+    Tesseract's own threading scales poorly, so one single-threaded tesseract
+    per worker process is faster than several workers each spawning threads.
+    """
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+
+def page_layouts_ocr(doc: PdfDoc, indices: Optional[Iterable[int]] = None,
+                     workers: Optional[int] = None, ocr_dpi: Optional[int] = None) -> List[List[Dict[str, Any]]]:
+    """
+    page_layout_ocr for several pages (default: all), one list of spans per page in order.
+
+    Pages are rendered and OCR'd in worker processes (workers=None uses all cores,
+    1 runs in-process with tesseract's default threading).
+    """
+    indices = list(range(doc.num_pages)) if indices is None else list(indices)
+    if not _HAS_TESSERACT:
+        return [[] for _ in indices]
+    workers = min(workers or os.cpu_count() or 1, max(len(indices), 1))
+    worker = partial(page_layout_ocr, doc, ocr_dpi=ocr_dpi)
+    if workers == 1:
+        return [worker(i) for i in indices]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_single_threaded_ocr) as ex:
+        return list(ex.map(worker, indices))
+
+
 def page_layout_with_ocr(doc: PdfDoc, i: int) -> List[Dict[str, Any]]:
     """
     High-level API: get spans for page i.
@@ -273,14 +449,14 @@ def page_layout_with_ocr(doc: PdfDoc, i: int) -> List[Dict[str, Any]]:
     return ocr_spans
 
 
+# Math delimiters ($...$, \(..\), \[..\]) for find_equation_spans, compiled once
+MATH_DELIM_RE = re.compile(r"(\$.*?\$|\\\(.*?\\\)|\\\[.*?\\\])")
+
+
 def find_equation_spans(spans):
-    """
+    r"""
     Heuristic filter for spans that look like equations.
     Detects math delimiters ($...$, \(..\), \[..\]).
     """
-    eq_spans = []
-    math_pattern = re.compile(r"(\$.*?\$|\\\(.*?\\\)|\\\[.*?\\\])")
-    for s in spans:
-        if math_pattern.search(s["text"]):
-            eq_spans.append(s)
-    return eq_spans
+    search = MATH_DELIM_RE.search
+    return [s for s in spans if search(s["text"])]
@@ -2,7 +2,15 @@
 from __future__ import annotations
 import json, hashlib
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Iterable
+
+# Optional fast JSON encoder for batched JSONL appends
+try:
+    import orjson
+    _HAS_ORJSON = True
+except Exception:
+    orjson = None
+    _HAS_ORJSON = False
 
 def ensure_dir(p: Path): p.mkdir(parents=True, exist_ok=True)
 
@@ -18,14 +26,28 @@ def append_jsonl(path: Path, record: Dict[str, Any]):
     with path.open("a", encoding="utf-8") as f:
         f.write(json.dumps(record, ensure_ascii=False) + "\n")
 
+def append_jsonl_many(path: Path, records: Iterable[Dict[str, Any]]):
+    """Append many records with a single open + write."""
+    if _HAS_ORJSON:
+        payload = b"".join(orjson.dumps(r) + b"\n" for r in records)
+    else:
+        payload = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records).encode("utf-8")
+    if not payload:
+        return
+    with path.open("ab") as f:
+        f.write(payload)
+
 # def save_equation(root: Path, paper_id: str, record: Dict[str, Any]):
 #     d = paper_dir(root, paper_id)
 #     append_jsonl(d / "equations.jsonl", record)
 def save_equation(root: Path, paper_id: str, record: Dict[str, Any]):
+    save_equations(root, paper_id, [record])
+
+def save_equations(root: Path, paper_id: str, records: Iterable[Dict[str, Any]]):
     d = paper_dir(root, paper_id)
     path = d / "equations.jsonl"
     print(f"[save_equation] writing to: {path}")  # DEBUG
-    append_jsonl(path, record)
+    append_jsonl_many(path, records)
 
 
 def save_symbol(root: Path, paper_id: str, record: Dict[str, Any]):
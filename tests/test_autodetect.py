@@ -0,0 +1,19 @@
+# tests/test_autodetect.py
+import os
+from pathlib import Path
+
+import pytest
+
+from equation_scribe.autodetect_equations import AutoDetectConfig, autodetect_equations
+
+HERE = Path(__file__).resolve().parent
+DEFAULT_PDF = HERE.parent / "data" / "2105.02081v2.pdf"
+PDF_SAMPLE = Path(os.getenv("PDF_SAMPLE", str(DEFAULT_PDF)))
+
+
+@pytest.mark.skipif(not PDF_SAMPLE.exists(), reason="No sample PDF found.")
+def test_parallel_matches_serial(tmp_path: Path):
+    serial = autodetect_equations(PDF_SAMPLE, "p", tmp_path, cfg=AutoDetectConfig(workers=1))
+    parallel = autodetect_equations(PDF_SAMPLE, "p", tmp_path, cfg=AutoDetectConfig(workers=2))
+    assert serial
+    assert parallel == serial
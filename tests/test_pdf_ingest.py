@@ -6,8 +6,11 @@ import pytest
 from equation_scribe.pdf_ingest import (
     load_pdf,
     page_image,
+    page_images,
     page_layout,
     pdf_to_px_transform,
+    pdf_bboxes_to_px,
+    px_bboxes_to_pdf,
     find_equation_spans,
 )
 from equation_scribe.validate import validate_latex
@@ -92,3 +95,81 @@ def test_equation_detection_and_validation():
     for e in eqs:
         res = validate_latex(e["text"])
         assert res.ok or res.errors  # Either it parses or yields structured errors
+
+
+@pytest.mark.skipif(
+    not PDF_SAMPLE.exists(),
+    reason=(
+        "No sample PDF found. Set PDF_SAMPLE env var to a valid PDF path or "
+        "place a test PDF under data/."
+    ),
+)
+def test_batch_bbox_transforms_match_scalar():
+    doc = load_pdf(PDF_SAMPLE, dpi=200)
+    pdf2px, px2pdf = pdf_to_px_transform(doc, 0)
+    boxes = [span["bbox"] for span in page_layout(doc, 0)[:50]]
+
+    px = pdf_bboxes_to_px(doc, 0, boxes)
+    assert px.shape == (len(boxes), 4)
+    for b, row in zip(boxes, px.tolist()):
+        assert row == [*pdf2px(b[0], b[1]), *pdf2px(b[2], b[3])]
+
+    back = px_bboxes_to_pdf(doc, 0, px)
+    for row_px, row_pt in zip(px.tolist(), back.tolist()):
+        assert row_pt == [*px2pdf(row_px[0], row_px[1]), *px2pdf(row_px[2], row_px[3])]
+
+
+@pytest.mark.skipif(
+    not PDF_SAMPLE.exists(),
+    reason=(
+        "No sample PDF found. Set PDF_SAMPLE env var to a valid PDF path or "
+        "place a test PDF under data/."
+    ),
+)
+def test_page_images_match_page_image():
+    doc = load_pdf(PDF_SAMPLE, dpi=72)
+    indices = list(range(min(doc.n_pages, 3)))[::-1]
+    for workers in (1, 2):
+        imgs = page_images(doc, indices, workers=workers)
+        assert len(imgs) == len(indices)
+        for i, img in zip(indices, imgs):
+            assert img.tobytes() == page_image(doc, i).tobytes()
+
+
+@pytest.mark.skipif(
+    not PDF_SAMPLE.exists(),
+    reason=(
+        "No sample PDF found. Set PDF_SAMPLE env var to a valid PDF path or "
+        "place a test PDF under data/."
+    ),
+)
+def test_cached_handles_reused_and_not_pickled():
+    import pickle
+
+    with load_pdf(PDF_SAMPLE, dpi=72) as doc:
+        first = page_layout(doc, 0)
+        page_image(doc, 0)
+        fitz_doc = doc.fitz()
+        assert doc.fitz() is fitz_doc
+        assert page_layout(doc, 0) == first
+
+        copy = pickle.loads(pickle.dumps(doc))
+        assert copy == doc
+        assert copy._fitz_doc is None and copy._plumber_doc is None
+        assert page_layout(copy, 0) == first
+        copy.close()
+    assert doc._fitz_doc is None and doc._plumber_doc is None
+
+
+@pytest.mark.skipif(
+    not PDF_SAMPLE.exists(),
+    reason=(
+        "No sample PDF found. Set PDF_SAMPLE env var to a valid PDF path or "
+        "place a test PDF under data/."
+    ),
+)
+def test_load_pdf_leaves_no_open_handles():
+    # callers that only need sizes/transforms never close the doc, so
+    # load_pdf itself must not keep a document open
+    doc = load_pdf(PDF_SAMPLE, dpi=72)
+    assert doc._fitz_doc is None and doc._plumber_doc is None
@@ -0,0 +1,14 @@
+# tests/test_store.py
+import json
+from pathlib import Path
+
+from equation_scribe.store import save_equation, save_equations
+
+def test_save_equations_appends_batch(tmp_path: Path):
+    recs = [{"eq_uid": f"e{i}", "latex": f"x^{i}"} for i in range(3)]
+    save_equations(tmp_path, "p1", recs)
+    save_equation(tmp_path, "p1", {"eq_uid": "e3", "latex": "α"})
+
+    lines = (tmp_path / "p1" / "equations.jsonl").read_text(encoding="utf-8").splitlines()
+    assert [json.loads(l)["eq_uid"] for l in lines] == ["e0", "e1", "e2", "e3"]
+    assert json.loads(lines[-1])["latex"] == "α"